@@ -36,40 +36,58 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'django.contrib.staticfiles',
+    'users.apps.UsersStaticFilesConfig',
     'users',
 ]
 
 AUTH_USER_MODEL = 'users.User'
+# request.user comes from the cache (users.cache.get_user) and is dropped from it on User save.
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
 LOGIN_REDIRECT_URL = '/users/'
 LOGOUT_REDIRECT_URL = '/users/login/'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 MIDDLEWARE = [
+    'users.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.UserShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query count, DB/template/total time in Server-Timing headers and
+# rolling percentiles at /users/metrics/ (staff only). Off by default.
+REQUEST_METRICS = False
+
 ROOT_URLCONF = 'BudgetAnalysisWeb.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'users/templates/users'],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.user_data_version',
+                'users.context_processors.static_version',
             ],
+            # In production every template (with its extends and includes) is read and
+            # compiled once per process. With DEBUG templates are re-read on each render,
+            # so edits show up without a restart.
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
         },
     },
 ]
@@ -84,9 +102,63 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Persistent connections: the PRAGMAs from users.db (WAL, busy_timeout, ...)
+        # run once per connection instead of once per request.
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+        },
+    },
+    # Spare shard: stays empty until it is listed in USER_SHARDS (prepare it with
+    # `manage.py migrate --database shard_1`). The sharding tests move users into it.
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_shard_1.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+        },
+    },
+}
+
+
+# User data shards. Each alias must also be listed in DATABASES, e.g.
+#   'shard_1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db_shard_1.sqlite3'}
+# and migrated with `manage.py migrate_shards`. Before changing this list run
+# `manage.py rebalance_shards --pin` so existing users keep their shard.
+
+USER_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['users.sharding.UserShardRouter']
+
+# Threads (each with its own DB connection) used by the async dashboard at
+# /users/ to run its queries concurrently; 0 runs them one after another.
+# None picks 4 threads, or 0 on SQLite, where the local queries are shorter
+# than the hand-off to the pool (measured 16.2 ms with 4 threads vs 15.1 ms).
+
+DASHBOARD_WORKERS = None
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Per-user data (users.cache) works with any backend, e.g. FileBasedCache
+# shared between several worker processes. Template fragments ({% cache %} in
+# the profile templates) are stored here as well unless a 'template_fragments'
+# cache is added.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'smartbudget',
     }
 }
 
+# Sessions are read from the cache and written through to the database, so an
+# authenticated request does not query django_session. With several worker
+# processes the cache above must be shared between them (e.g. Redis, Memcached).
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -130,6 +202,34 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
 
+# `manage.py collectstatic` writes content-hashed copies (bundles/main.1a2b3c4d5e6f.css)
+# plus .gz and .br variants (.br needs the optional `brotli` package) into STATIC_ROOT;
+# users.views.serve_static serves them with immutable cache headers.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STATICFILES_STORAGE = 'users.staticfiles.CompressedManifestStaticFilesStorage'
+
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'users.staticfiles.BundleFinder',
+]
+
+# Bundles built by users.staticfiles.BundleFinder from the files found by the other
+# finders: concatenated, CSS minified. Rebuilt into STATIC_BUILD_ROOT when a source changes.
+STATIC_BUILD_ROOT = BASE_DIR / 'build' / 'static'
+
+STATIC_BUNDLES = {
+    'bundles/vendor.css': ['vendor/bootstrap/css/bootstrap.min.css'],
+    'bundles/base.css': ['css/base.css'],
+    'bundles/accounts.css': ['css/styleAccounts.css'],
+    'bundles/categories.css': ['css/styleCategory.css'],
+    'bundles/login.css': ['css/styleLogIn.css'],
+    'bundles/main.css': ['css/styleMain.css'],
+    'bundles/profile.css': ['css/styleUserProfile.css'],
+    'bundles/register.css': ['css/styleRegister.css'],
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -13,12 +13,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.views.generic import TemplateView
 
+from users.views import serve_icon, serve_static
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
+    re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.+)$', serve_static, name='static'),
+    re_path(r'^icons/(?P<shard>[0-9a-f]{2})/(?P<filename>[0-9a-f]{32}\.webp)$', serve_icon, name='icon'),
     path('', TemplateView.as_view(template_name='users/registration/home.html'), name='home'),
 ]
@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
 from users.forms import UserCreationFormImpl
-from users.models import UserDataModel, CategoryModel, Account, Transaction
+from users.models import UserDataModel, CategoryModel, CategoryBudget, Account, Transaction, RecurringTransaction
 
 User = get_user_model()
 
@@ -32,3 +32,7 @@ admin.site.register(CategoryModel)
 admin.site.register(Account)
 
 admin.site.register(Transaction)
+
+admin.site.register(RecurringTransaction)
+
+admin.site.register(CategoryBudget)
@@ -0,0 +1,103 @@
+import calendar
+
+import numpy as np
+from django.db.models import FloatField, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from users.cache import cached_for_user, get_categories
+from users.models import CategoryModel, Transaction
+
+ROLLING_MONTHS = 3
+FORECAST_HISTORY_DAYS = 90
+
+
+def load_daily_totals(user):
+    """
+    Суммы операций пользователя по (день, категория) одним запросом в массивы NumPy.
+    Группировка выполняется в базе по индексу transaction_analytics_idx, поэтому
+    число строк ограничено днями x категориями, а не числом операций.
+    """
+    rows = Transaction.objects.filter(user=user, category__isnull=False).order_by() \
+        .values_list('date', 'category_id') \
+        .annotate(total=Cast(Sum('amount'), FloatField()))
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    dates, category_ids, totals = zip(*rows)
+    return np.array(dates, dtype='datetime64[D]'), np.array(category_ids, dtype=np.int64), np.array(totals)
+
+
+def rolling_mean(values, window=ROLLING_MONTHS):
+    # Для первых месяцев среднее по тем, что есть.
+    sums = np.convolve(values, np.ones(window), mode='full')[:len(values)]
+    return sums / np.minimum(np.arange(1, len(values) + 1), window)
+
+
+def _rounded(values):
+    return [None if np.isnan(value) else round(float(value), 2) for value in values]
+
+
+def compute_analytics(user, today=None):
+    today = today or timezone.localdate()
+    dates, category_ids, totals = load_daily_totals(user)
+    categories = get_categories(user)
+    known_ids = np.array([category.pk for category in categories], dtype=np.int64)
+    is_income = np.array([category.key == CategoryModel.INCOME for category in categories], dtype=bool)
+
+    # get_categories упорядочен по id. Категории, которых нет в списке, пропускаются.
+    positions = np.searchsorted(known_ids, category_ids)
+    valid = positions < len(known_ids)
+    valid[valid] = known_ids[positions[valid]] == category_ids[valid]
+    dates, positions, totals = dates[valid], positions[valid], totals[valid]
+
+    current_month = np.datetime64(today, 'M')
+    first_month = min(dates.min().astype('datetime64[M]'), current_month) if len(dates) else current_month
+    last_month = max(dates.max().astype('datetime64[M]'), current_month) if len(dates) else current_month
+    months = np.arange(first_month, last_month + 1)
+    month_positions = (dates.astype('datetime64[M]') - first_month).astype(np.int64)
+    matrix = np.bincount(month_positions * len(categories) + positions, weights=totals,
+                         minlength=len(months) * len(categories)).reshape(len(months), len(categories))
+
+    expense = ~is_income[positions]
+    income = matrix[:, is_income].sum(axis=1)
+    expenses = matrix[:, ~is_income].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        savings_rate = np.where(income > 0, (income - expenses) / income, np.nan)
+
+    return {
+        'months': [str(month) for month in months],
+        'income': _rounded(income),
+        'expenses': _rounded(expenses),
+        'rolling_income': _rounded(rolling_mean(income)),
+        'rolling_expenses': _rounded(rolling_mean(expenses)),
+        'savings_rate': _rounded(savings_rate),
+        'categories': [
+            {'id': category.pk, 'name': category.category_name, 'key': category.key,
+             'monthly': _rounded(matrix[:, position]), 'total': round(float(matrix[:, position].sum()), 2)}
+            for position, category in enumerate(categories)
+        ],
+        'forecast': forecast_expenses(dates[expense], totals[expense], today),
+    }
+
+
+def forecast_expenses(dates, totals, today):
+    """Расходы до конца месяца: уже потраченное плюс средний дневной расход за FORECAST_HISTORY_DAYS."""
+    month_start = np.datetime64(today.replace(day=1), 'D')
+    history_start = month_start - FORECAST_HISTORY_DAYS
+    spent = totals[(dates >= month_start) & (dates <= np.datetime64(today, 'D'))].sum()
+    history = totals[(dates >= history_start) & (dates < month_start)].sum()
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    remaining = days_in_month - today.day
+    daily = history / FORECAST_HISTORY_DAYS
+    return {
+        'spent': round(float(spent), 2),
+        'daily_average': round(float(daily), 2),
+        'remaining_days': remaining,
+        'projected': round(float(spent + daily * remaining), 2),
+    }
+
+
+def get_analytics(user, today=None):
+    # Версия данных пользователя меняется при любой записи операции, дата - каждый день.
+    today = today or timezone.localdate()
+    return cached_for_user(user, f'analytics:{today.isoformat()}', lambda: compute_analytics(user, today))
@@ -0,0 +1,120 @@
+import hashlib
+from collections import namedtuple
+from functools import wraps
+
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_safe
+
+from users.models import Account, CategoryModel, DeletedRecord, Transaction
+from users.storage import icon_storage
+from users.sync import changed_after, decode_cursor, encode_cursor, sync_state
+
+API_VERSION = 1
+API_PAGE_SIZE = 500
+
+# Поля ответа API и соответствующие им поля модели.
+Resource = namedtuple('Resource', ['model', 'fields'])
+RESOURCES = {
+    'accounts': Resource(Account, {
+        'id': 'id', 'name': 'name', 'balance': 'balance', 'icon': 'icon', 'version': 'version',
+    }),
+    'categories': Resource(CategoryModel, {
+        'id': 'id', 'name': 'category_name', 'key': 'key', 'icon': 'icon', 'version': 'version',
+    }),
+    'transactions': Resource(Transaction, {
+        'id': 'id', 'date': 'date', 'amount': 'amount', 'from_account': 'from_account_id',
+        'to_account': 'to_account_id', 'category': 'category_id', 'comment': 'comment', 'version': 'version',
+    }),
+}
+CONVERTERS = {
+    'icon': lambda name: icon_storage.url(name) if name else None,
+}
+
+
+def api_login_required(view):
+    # Вместо перенаправления на страницу входа API отвечает 401.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Требуется вход'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def resource_etag(request, resource):
+    # Ответ однозначно определяется пользователем, адресом и номером последнего
+    # изменения, поэтому для 304 не нужен ни один запрос к данным, кроме счетчика.
+    version, reset_version = sync_state(request.user)
+    key = f'{API_VERSION}|{request.user.pk}|{version}|{reset_version}|{request.get_full_path()}'
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def _requested_fields(request, resource):
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(resource.fields)
+    names = [name for name in fields.split(',') if name]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        return None
+    return ['id'] + [name for name in names if name != 'id']
+
+
+def _serialize(row, fields, resource):
+    return {
+        name: CONVERTERS[name](row[resource.fields[name]]) if name in CONVERTERS else row[resource.fields[name]]
+        for name in fields
+    }
+
+
+@api_login_required
+@require_safe
+@condition(etag_func=resource_etag)
+def api_resource(request, resource):
+    """
+    Список строк пользователя в порядке изменения. ?fields=id,name - только эти поля,
+    ?since=<cursor> - только строки, измененные после курсора, и id удаленных.
+    Курсор для следующего запроса - в поле cursor; more - есть следующая страница.
+    """
+    resource = RESOURCES[resource]
+    fields = _requested_fields(request, resource)
+    if fields is None:
+        return JsonResponse({'errors': {'fields': [f'Доступные поля: {", ".join(resource.fields)}']}}, status=400)
+    position = None
+    if request.GET.get('since'):
+        position = decode_cursor(request.GET['since'])
+        if position is None:
+            return JsonResponse({'errors': {'since': ['Неверный курсор']}}, status=400)
+
+    version, reset_version = sync_state(request.user)
+    # Курсор, выданный до переноса данных в другую шарду, ссылается на старые id.
+    reset = position is not None and position[0] < reset_version
+    if reset:
+        position = None
+
+    queryset = resource.model.objects.filter(user=request.user, version__lte=version).order_by('version', 'id')
+    if position is not None:
+        queryset = changed_after(queryset, *position)
+    columns = {resource.fields[name] for name in fields} | {'id', 'version'}
+    rows = list(queryset.values(*columns)[:API_PAGE_SIZE + 1])
+    more = len(rows) > API_PAGE_SIZE
+    rows = rows[:API_PAGE_SIZE]
+
+    deleted = []
+    if position is not None:
+        deleted = list(DeletedRecord.objects.filter(
+            user=request.user, model_name=resource.model._meta.model_name,
+            version__gt=position[0], version__lte=version,
+        ).order_by('version').values_list('object_id', flat=True))
+
+    response = JsonResponse({
+        'results': [_serialize(row, fields, resource) for row in rows],
+        'deleted': deleted,
+        'cursor': encode_cursor(rows[-1]['version'], rows[-1]['id']) if more else encode_cursor(version),
+        'more': more,
+        'reset': reset,
+    })
+    response['API-Version'] = API_VERSION
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.contrib.staticfiles.apps import StaticFilesConfig
 
 
 class UsersConfig(AppConfig):
+    default = True
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from users import cache, db, ledger, search, sync  # noqa: F401
+
+
+class UsersStaticFilesConfig(StaticFilesConfig):
+    default = False
+    # Иконки пользователей (users.storage) лежат в users/static/images/cas и
+    # отдаются serve_icon, в collectstatic им делать нечего.
+    ignore_patterns = StaticFilesConfig.ignore_patterns + ['cas']
@@ -0,0 +1,13 @@
+from django.contrib.auth.backends import ModelBackend
+
+from users.cache import get_user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который берет пользователя для request.user из кэша (users.cache.get_user),
+    а не из базы на каждом запросе.
+    """
+
+    def get_user(self, user_id):
+        return get_user(user_id, lambda: super(CachedModelBackend, self).get_user(user_id))
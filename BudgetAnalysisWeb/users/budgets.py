@@ -0,0 +1,163 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, post_save
+from django.utils import timezone
+
+from users.models import CategoryBudget, Transaction
+
+ZERO = Decimal('0')
+PERIODS = [period for period, _ in CategoryBudget.PERIOD_CHOICES]
+CENT = Decimal('0.01')
+
+
+def period_start(period, date):
+    if period == CategoryBudget.WEEK:
+        return date - datetime.timedelta(days=date.weekday())
+    return date.replace(day=1)
+
+
+def period_end(period, start):
+    """Первый день следующего периода."""
+    if period == CategoryBudget.WEEK:
+        return start + datetime.timedelta(days=7)
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def budget_deltas(states, sign=1):
+    """{(id категории, дата): изменение spent} для состояний операций из users.ledger.transaction_state."""
+    deltas = defaultdict(Decimal)
+    for state in states:
+        if state['category_id'] is not None:
+            deltas[(state['category_id'], state['date'])] += Decimal(state['amount']) * sign
+    return deltas
+
+
+def apply_budget_deltas(deltas):
+    """
+    Прибавляет изменения к spent бюджетов. Вызывается из users.ledger в транзакции,
+    которая записывает операции; для одной операции это один UPDATE без чтения.
+    """
+    groups = defaultdict(Decimal)
+    for (category_id, date), delta in deltas.items():
+        groups[(category_id,) + tuple(period_start(period, date) for period in PERIODS)] += delta
+    groups = {key: delta for key, delta in groups.items() if delta}
+    if len(groups) > 1:
+        # Пачка операций (выписка, повторяющиеся операции): UPDATE только для категорий с бюджетами.
+        budgeted = set(CategoryBudget.objects.filter(category_id__in={key[0] for key in groups})
+                       .values_list('category_id', flat=True))
+        groups = {key: delta for key, delta in groups.items() if key[0] in budgeted}
+    for (category_id, *starts), delta in sorted(groups.items()):
+        current = reduce(or_, (Q(period=period, period_start=start) for period, start in zip(PERIODS, starts)))
+        CategoryBudget.objects.filter(current, category_id=category_id).update(spent=F('spent') + delta)
+
+
+def _spent(start, end):
+    # Сумма операций категории бюджета за [start, end) по индексу transaction_analytics_idx.
+    rows = Transaction.objects.filter(user_id=OuterRef('user_id'), category_id=OuterRef('category_id'),
+                                      date__gte=start, date__lt=end)
+    total = rows.order_by().values('category_id').annotate(total=Sum('amount')).values('total')
+    output_field = DecimalField(max_digits=14, decimal_places=2)
+    return Coalesce(Subquery(total, output_field=output_field), Value(ZERO), output_field=output_field)
+
+
+def _by_period(budgets):
+    return budgets.order_by().values_list('period', 'period_start').distinct()
+
+
+def recompute_spent(budgets):
+    """Пересчитывает spent по журналу операций: один UPDATE на вид и начало периода. Возвращает число бюджетов."""
+    updated = 0
+    for period, start in list(_by_period(budgets)):
+        updated += budgets.filter(period=period, period_start=start) \
+            .update(spent=_spent(start, period_end(period, start)))
+    return updated
+
+
+def rollover_budgets(today=None, user_ids=None):
+    """
+    Переводит бюджеты, период которых закончился, на текущий период. spent нового
+    периода считается по журналу: в нем уже могут быть операции, записанные заранее.
+    """
+    today = today or timezone.localdate()
+    budgets = CategoryBudget.objects.all()
+    if user_ids is not None:
+        budgets = budgets.filter(user_id__in=user_ids)
+    rolled = 0
+    for period in PERIODS:
+        start = period_start(period, today)
+        rolled += budgets.filter(period=period, period_start__lt=start) \
+            .update(period_start=start, spent=_spent(start, period_end(period, start)))
+    return rolled
+
+
+def check_budgets(user_ids=None, fix=False):
+    """
+    Сравнивает spent всех бюджетов с суммой операций за их период. Возвращает список
+    (бюджет id, spent, сумма по журналу) для расходящихся; с fix=True пересчитывает их.
+    """
+    budgets = CategoryBudget.objects.all()
+    if user_ids is not None:
+        budgets = budgets.filter(user_id__in=user_ids)
+    mismatched = []
+    for period, start in list(_by_period(budgets)):
+        rows = budgets.filter(period=period, period_start=start) \
+            .annotate(expected=_spent(start, period_end(period, start))) \
+            .values_list('pk', 'spent', 'expected').order_by('pk')
+        for pk, spent, expected in rows.iterator():
+            # SQLite хранит суммы в REAL: сравниваются значения, округленные до копеек.
+            if Decimal(spent).quantize(CENT) != Decimal(expected).quantize(CENT):
+                mismatched.append((pk, spent, expected))
+    if fix and mismatched:
+        recompute_spent(CategoryBudget.objects.filter(pk__in=[pk for pk, _, _ in mismatched]))
+    return mismatched
+
+
+def user_budgets(user, today=None):
+    """
+    Бюджеты пользователя с прогрессом текущего периода - одно чтение таблицы бюджетов.
+    Если ночной rollover_budgets еще не прошел, текущий период бюджетов с прошедшим
+    периодом считается по журналу только для показа: страница ничего не записывает.
+    """
+    today = today or timezone.localdate()
+    result = list(CategoryBudget.objects.filter(user=user).select_related('category')
+                  .order_by('category__category_name', 'period'))
+    stale = defaultdict(list)
+    for budget in result:
+        if budget.period_start != period_start(budget.period, today):
+            stale[budget.period].append(budget)
+    for period, budgets in stale.items():
+        start = period_start(period, today)
+        spent = dict(CategoryBudget.objects.filter(pk__in=[budget.pk for budget in budgets])
+                     .annotate(current=_spent(start, period_end(period, start))).values_list('pk', 'current'))
+        for budget in budgets:
+            budget.period_start, budget.spent = start, Decimal(spent[budget.pk])
+    return result
+
+
+def exceeded_budgets(user, category_id, date, amount):
+    """Бюджеты категории, которые операция на amount с датой date выведет за лимит."""
+    budgets = CategoryBudget.objects.filter(user=user, category_id=category_id).select_related('category')
+    return [budget for budget in budgets
+            if budget.period_start == period_start(budget.period, date) and budget.spent + amount > budget.limit]
+
+
+def budget_anchored(sender, instance, raw=False, **kwargs):
+    # Сохраненный бюджет (новый или с другим периодом) отсчитывает текущий период.
+    if not raw:
+        instance.period_start = period_start(instance.period, timezone.localdate())
+
+
+def budget_saved(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        recompute_spent(CategoryBudget.objects.using(using).filter(pk=instance.pk))
+        instance.refresh_from_db(fields=['spent'])
+
+
+pre_save.connect(budget_anchored, sender=CategoryBudget)
+post_save.connect(budget_saved, sender=CategoryBudget)
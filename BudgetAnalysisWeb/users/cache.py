@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from users.models import Account, CategoryModel, Transaction, User
+from users.sharding import PRIMARY_DATABASE, shard_for
+from users.signals import transactions_bulk_created
+
+USER_DATA_TIMEOUT = 60 * 60
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def hit_rates():
+    """{имя: {'hit', 'miss', 'hit_rate'}} по счетчикам stats() с запуска процесса."""
+    rates = {}
+    for key, value in stats().items():
+        name, _, kind = key.rpartition('_')
+        rates.setdefault(name, {'hit': 0, 'miss': 0})[kind] = value
+    for counts in rates.values():
+        counts['hit_rate'] = round(counts['hit'] / (counts['hit'] + counts['miss']), 3)
+    return dict(sorted(rates.items()))
+
+
+def _version_key(user_id):
+    return f'users:data-version:{user_id}'
+
+
+def data_version(user_id):
+    # Начальная версия берется из времени, а не 1: если ключ версии вытеснен
+    # из кэша, старые записи с прежней версией не станут снова актуальными.
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), time.time_ns(), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def _bump_version(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def invalidate_user(user_id):
+    # Второй сброс после коммита: иначе параллельный запрос мог успеть
+    # положить в кэш данные, прочитанные до фиксации транзакции.
+    _bump_version(user_id)
+    transaction.on_commit(lambda: _bump_version(user_id), using=shard_for(user_id))
+
+
+def cached_for_user(user, name, loader):
+    key = f'users:{name}:{user.pk}:{data_version(user.pk)}'
+    value = cache.get(key)
+    if value is None:
+        _count(f'{name}_miss')
+        value = loader()
+        cache.set(key, value, USER_DATA_TIMEOUT)
+    else:
+        _count(f'{name}_hit')
+    return value
+
+
+def get_categories(user):
+    return cached_for_user(user, 'categories', lambda: list(
+        CategoryModel.objects.filter(user=user).only('id', 'user_id', 'category_name', 'key', 'icon').order_by('id')
+    ))
+
+
+def get_accounts(user):
+    return cached_for_user(user, 'accounts', lambda: list(
+        Account.objects.filter(user=user).only('id', 'user_id', 'name', 'balance', 'icon').order_by('id')
+    ))
+
+
+def _user_key(user_id):
+    return f'users:user:{user_id}'
+
+
+def get_user(user_id, loader):
+    """
+    Пользователь из кэша на время жизни сессии; loader читает его из базы при промахе.
+    Запись пользователя (в том числе смена пароля, email_verify, last_login) удаляет его из кэша.
+    """
+    key = _user_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        _count('user_miss')
+        user = loader()
+        if user is not None:
+            cache.set(key, user, settings.SESSION_COOKIE_AGE)
+    else:
+        _count('user_hit')
+    return user
+
+
+def forget_user(user_id):
+    # Как и в invalidate_user: второй раз после коммита.
+    cache.delete(_user_key(user_id))
+    transaction.on_commit(lambda: cache.delete(_user_key(user_id)), using=PRIMARY_DATABASE)
+
+
+def user_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        forget_user(instance.pk)
+
+
+def user_data_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_user(instance.user_id)
+
+
+def transactions_created(sender, records, **kwargs):
+    for user_id in {record.user_id for record in records}:
+        invalidate_user(user_id)
+
+
+for model in (CategoryModel, Account, Transaction):
+    post_save.connect(user_data_changed, sender=model, dispatch_uid=f'users.cache.{model.__name__}.save')
+    post_delete.connect(user_data_changed, sender=model, dispatch_uid=f'users.cache.{model.__name__}.delete')
+transactions_bulk_created.connect(transactions_created)
+post_save.connect(user_changed, sender=User, dispatch_uid='users.cache.User.save')
+post_delete.connect(user_changed, sender=User, dispatch_uid='users.cache.User.delete')
@@ -0,0 +1,20 @@
+from users import staticfiles
+from users.cache import data_version
+
+
+def user_data_version(request):
+    """
+    data_version - версия данных пользователя для ключей {% cache %}: фрагмент с его
+    счетами пересобирается после любой записи его счетов, категорий и операций.
+    Версия читается из кэша только на страницах, где она нужна.
+    """
+    return {'data_version': lambda: data_version(request.user.pk)}
+
+
+def static_version(request):
+    """
+    static_version - версия сборки статики для ключей {% cache %} фрагментов без данных
+    пользователя (шапка, меню, подвал): один экземпляр на всех, адреса {% static %}
+    в нем обновляются после collectstatic.
+    """
+    return {'static_version': staticfiles.static_version}
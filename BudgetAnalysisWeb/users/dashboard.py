@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, router
+
+from users import metrics
+from users.cache import get_accounts
+from users.ledger import category_totals
+from users.models import CategoryModel, RecurringTransaction, Transaction
+
+DASHBOARD_WORKERS = 4
+RECENT_TRANSACTIONS = 10
+UPCOMING_DAYS = 30
+UPCOMING_ITEMS = 10
+
+
+def load_accounts(user, today):
+    return get_accounts(user)
+
+
+def load_month_totals(user, today):
+    totals = list(category_totals(user, today.replace(day=1), today))
+    return {
+        'expenses': [row for row in totals if row['key'] == CategoryModel.EXPENSES],
+        'income': [row for row in totals if row['key'] == CategoryModel.INCOME],
+    }
+
+
+def load_recent_transactions(user, today):
+    return list(
+        Transaction.objects.filter(user=user).select_related('from_account', 'to_account', 'category')
+        .only('id', 'date', 'amount', 'comment', 'from_account__name', 'to_account__name', 'category__category_name')
+        .order_by('-date', '-id')[:RECENT_TRANSACTIONS]
+    )
+
+
+def load_upcoming(user, today):
+    return list(
+        RecurringTransaction.objects.filter(
+            user=user, active=True, next_run__lte=today + datetime.timedelta(days=UPCOMING_DAYS),
+        ).select_related('from_account', 'to_account', 'category').order_by('next_run', 'id')[:UPCOMING_ITEMS]
+    )
+
+
+SECTIONS = {
+    'accounts': load_accounts,
+    'month_totals': load_month_totals,
+    'recent_transactions': load_recent_transactions,
+    'upcoming': load_upcoming,
+}
+
+
+def dashboard_workers():
+    workers = getattr(settings, 'DASHBOARD_WORKERS', None)
+    if workers is not None:
+        return workers
+    # Запросы к локальному файлу SQLite короче, чем передача раздела в пул
+    # (bench_dashboard: 16,2 мс с 4 потоками против 15,1 мс по очереди).
+    if connections[router.db_for_read(Transaction)].vendor == 'sqlite':
+        return 0
+    return DASHBOARD_WORKERS
+
+
+@lru_cache(maxsize=None)
+def _executor(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dashboard')
+
+
+def _run_section(loader, user, today):
+    # Потоки пула живут дольше запроса: соединения проверяются так же,
+    # как это делает обработчик запроса в начале и в конце.
+    close_old_connections()
+    try:
+        if metrics.current_metrics() is None:
+            return loader(user, today), None
+        # execute_wrapper из RequestMetricsMiddleware стоит только на соединениях
+        # потока запроса: запросы раздела считаются отдельно и добавляются к запросу.
+        with metrics.track_queries(metrics.RequestMetrics()) as section_metrics:
+            return loader(user, today), section_metrics
+    finally:
+        close_old_connections()
+
+
+def load_dashboard(user, today):
+    """Все разделы главной страницы по очереди в текущем потоке."""
+    return {name: loader(user, today) for name, loader in SECTIONS.items()}
+
+
+async def gather_dashboard(user, today):
+    """
+    Разделы главной страницы параллельно в пуле из DASHBOARD_WORKERS потоков
+    со своими соединениями: время ответа - примерно время самого долгого запроса.
+    При DASHBOARD_WORKERS = 0 (по умолчанию на SQLite) разделы загружаются
+    по очереди в потоке запроса.
+    """
+    workers = dashboard_workers()
+    if not workers:
+        return await sync_to_async(load_dashboard)(user, today)
+    # sync_to_async переносит в поток contextvars, в том числе шарду из use_database().
+    run = sync_to_async(_run_section, thread_sensitive=False, executor=_executor(workers))
+    results = await asyncio.gather(*(run(loader, user, today) for loader in SECTIONS.values()))
+    request_metrics = metrics.current_metrics()
+    for _, section_metrics in results:
+        if request_metrics is not None and section_metrics is not None:
+            request_metrics.merge(section_metrics)
+    return {name: result for name, (result, _) in zip(SECTIONS, results)}
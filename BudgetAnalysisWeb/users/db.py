@@ -0,0 +1,67 @@
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connections, router
+from django.db.backends.signals import connection_created
+
+# Настройки SQLite для работы под нагрузкой. WAL позволяет читать во время
+# записи, synchronous=NORMAL в режиме WAL не рискует целостностью базы,
+# а только последними транзакциями при отключении питания.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+LOCKED_RETRY_ATTEMPTS = 5
+LOCKED_RETRY_BASE_DELAY = 0.05
+
+
+def sqlite_pragmas():
+    pragmas = dict(SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked_error(error):
+    return isinstance(error, OperationalError) and 'database is locked' in str(error)
+
+
+def retry_on_locked(func=None, *, model=None, attempts=LOCKED_RETRY_ATTEMPTS, base_delay=LOCKED_RETRY_BASE_DELAY):
+    """
+    Повторяет запись, если SQLite ответил "database is locked". busy_timeout
+    не помогает, когда транзакция уже читала и пытается начать запись: SQLite
+    сразу возвращает ошибку, и повторить можно только всю транзакцию целиком.
+    Внутри внешнего atomic() повтор невозможен, ошибка передается дальше.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, model=model, attempts=attempts, base_delay=base_delay)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        connection = connections[router.db_for_write(model) if model else 'default']
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_locked_error(e) or connection.in_atomic_block or attempt == attempts - 1:
+                    raise
+            time.sleep(base_delay * 2 ** attempt * (1 + random.random()))
+    return wrapper
+
+
+connection_created.connect(configure_sqlite, dispatch_uid='users.db.configure_sqlite')
@@ -0,0 +1,14 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_CATEGORIES_TEMPLATE = Path(__file__).resolve().parent / 'data' / 'default_categories.json'
+
+
+@lru_cache(maxsize=None)
+def default_categories_template(path=None):
+    path = path or getattr(settings, 'DEFAULT_CATEGORIES_TEMPLATE', DEFAULT_CATEGORIES_TEMPLATE)
+    with open(path, encoding='utf-8') as f:
+        return tuple(json.load(f))
@@ -0,0 +1,155 @@
+import csv
+import re
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from users.models import Transaction
+from users.pagination import keyset_iterate
+
+EXPORT_HEADER = ('Дата', 'Со счета', 'На счет', 'Сумма', 'Категория', 'Комментарий')
+EXPORT_BATCH_SIZE = 2000
+# Ячейку с таким началом Excel и LibreOffice считают формулой (CSV injection):
+# перед ней ставится апостроф, и значение показывается как текст.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Управляющие символы, которые запрещены в XML 1.0 даже в виде ссылок &#...;.
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def export_queryset(user):
+    return Transaction.objects.filter(user=user) \
+        .select_related('from_account', 'to_account', 'category') \
+        .only('id', 'date', 'amount', 'comment', 'from_account__name', 'to_account__name',
+              'category__category_name')
+
+
+def export_rows(user, batch_size=EXPORT_BATCH_SIZE):
+    for record in keyset_iterate(export_queryset(user), batch_size=batch_size):
+        yield (
+            record.date.isoformat(),
+            record.from_account.name,
+            record.to_account.name,
+            record.amount,
+            record.category.category_name if record.category else '',
+            record.comment or '',
+        )
+
+
+class _Buffer:
+    """Файлоподобный объект, из которого генератор забирает накопленные байты."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def encode_csv(rows, flush_every=500):
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADER)
+    yield buffer.drain()
+    for number, row in enumerate(rows, start=1):
+        writer.writerow([_csv_cell(value) for value in row])
+        if number % flush_every == 0:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Операции" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_row(row):
+    cells = []
+    for value in row:
+        if isinstance(value, str):
+            cells.append(f'<c t="inlineStr"><is><t>{escape(XML_ILLEGAL_CHARS.sub("", value))}</t></is></c>')
+        else:
+            cells.append(f'<c><v>{value}</v></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def encode_xlsx(rows, flush_every=500):
+    # zipfile умеет писать в поток без seek(), поэтому книга собирается
+    # и отдается по мере чтения строк, без временного файла.
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                .encode('utf-8')
+            )
+            sheet.write(_xlsx_row(EXPORT_HEADER).encode('utf-8'))
+            yield buffer.drain()
+            for number, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                if number % flush_every == 0:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
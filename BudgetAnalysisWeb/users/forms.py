@@ -1,3 +1,5 @@
+import codecs
+
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.forms import (
     UserCreationForm as DjangoUserCreationForm,
@@ -5,10 +7,15 @@ from django.contrib.auth.forms import (
 )
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.urls import reverse_lazy
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from users.models import UserDataModel, CategoryModel, Account, Transaction
-from users.utils import send_email_for_verify
+from users.budgets import exceeded_budgets
+from users.models import UserDataModel, CategoryModel, CategoryBudget, Account, Transaction
+from users.outbox import send_email_for_verify
+from users.search import filter_matching
 
 User = get_user_model()
 
@@ -22,15 +29,14 @@ class AuthenticationForm(DjangoAuthenticationForm):
         if username is not None and password:
             self.user_cache = authenticate(self.request, username=username, password=password)
 
+            if self.user_cache is None:
+                raise self.get_invalid_login_error()
+
             if not self.user_cache.email_verify:
                 send_email_for_verify(self.request, self.user_cache)
                 raise ValidationError('Ваш почта не верифицирована, проверьте ее', code='invalid_login')
 
-            if self.user_cache is None:
-                raise self.get_invalid_login_error()
-
-            else:
-                self.confirm_login_allowed(self.user_cache)
+            self.confirm_login_allowed(self.user_cache)
 
         return self.cleaned_data
 
@@ -79,10 +85,123 @@ class AccountForm(forms.ModelForm):
 
 
 class TransactionForm(forms.ModelForm):
+    exceed_budget = forms.BooleanField(required=False, label='Превысить бюджет', widget=forms.HiddenInput)
+
     class Meta:
         model = Transaction
-        fields = ['from_account', 'to_account', 'amount', 'date', 'comment']
+        fields = ['from_account', 'to_account', 'amount', 'date', 'category', 'comment']
 
         widgets = {
             'date': forms.DateInput(attrs={'type': 'date'}),
         }
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super(TransactionForm, self).__init__(*args, **kwargs)
+        accounts = Account.objects.filter(user=self.user).only('id', 'name').order_by('name', 'id')
+        autocomplete_url = reverse_lazy('account_autocomplete')
+        for field_name in ('from_account', 'to_account'):
+            self.fields[field_name].queryset = accounts
+            self.fields[field_name].widget.attrs['data-autocomplete-url'] = autocomplete_url
+        self.fields['category'].queryset = CategoryModel.objects.filter(user=self.user) \
+            .only('id', 'category_name', 'key').order_by('key', 'category_name')
+        self.fields['category'].label_from_instance = lambda category: category.category_name
+
+    def clean(self):
+        cleaned_data = super().clean()
+        category, amount = cleaned_data.get('category'), cleaned_data.get('amount')
+        if category is not None and amount is not None and not cleaned_data.get('exceed_budget'):
+            date = cleaned_data.get('date') or timezone.localdate()
+            exceeded = exceeded_budgets(self.user, category.pk, date, amount)
+            if exceeded:
+                # Флажок показывается только вместе с предупреждением.
+                self.fields['exceed_budget'].widget = forms.CheckboxInput()
+                names = ', '.join(f'«{budget.category} ({budget.get_period_display()})»' for budget in exceeded)
+                raise ValidationError(f'Операция превысит бюджет {names}: отметьте «Превысить бюджет», '
+                                      f'чтобы сохранить ее', code='budget_exceeded')
+        return cleaned_data
+
+
+class CategoryBudgetForm(forms.ModelForm):
+    class Meta:
+        model = CategoryBudget
+        fields = ['category', 'period', 'limit']
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['category'].queryset = CategoryModel.objects.filter(user=self.user, key=CategoryModel.EXPENSES) \
+            .only('id', 'category_name').order_by('category_name')
+        self.fields['category'].label_from_instance = lambda category: category.category_name
+
+
+class StatementUploadForm(forms.Form):
+    FORMAT_CHOICES = (
+        ('', 'Определить по расширению'),
+        ('csv', 'CSV'),
+        ('ofx', 'OFX'),
+    )
+    ENCODING_CHOICES = (
+        ('', 'UTF-8'),
+        ('cp1251', 'Windows-1251'),
+    )
+    DEFAULT_ENCODING = 'utf-8-sig'
+    CHECK_CHUNK_SIZE = 64 * 1024
+    account = forms.ModelChoiceField(queryset=Account.objects.none(), label='Счет')
+    file = forms.FileField(label='Файл выписки')
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False, label='Формат')
+    encoding = forms.ChoiceField(choices=ENCODING_CHOICES, required=False, label='Кодировка')
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super(StatementUploadForm, self).__init__(*args, **kwargs)
+        self.fields['account'].queryset = Account.objects.filter(user=self.user).only('id', 'name') \
+            .order_by('name', 'id')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data['encoding'] = cleaned_data.get('encoding') or self.DEFAULT_ENCODING
+        upload = cleaned_data.get('file')
+        if upload is not None:
+            # Файл проверяется целиком до загрузки: ошибка декодирования посреди
+            # импорта оставила бы выписку загруженной наполовину.
+            decoder = codecs.getincrementaldecoder(cleaned_data['encoding'])()
+            try:
+                for chunk in upload.chunks(self.CHECK_CHUNK_SIZE):
+                    decoder.decode(chunk)
+                decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self.add_error('file', 'Файл не в выбранной кодировке: выберите другую, например Windows-1251')
+            upload.seek(0)
+        return cleaned_data
+
+
+class TransactionFilterForm(forms.Form):
+    account = forms.ModelChoiceField(queryset=Account.objects.none(), required=False, label='Счет')
+    date_from = forms.DateField(required=False, label='С', widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, label='По', widget=forms.DateInput(attrs={'type': 'date'}))
+    amount_min = forms.DecimalField(required=False, label='Сумма от')
+    amount_max = forms.DecimalField(required=False, label='Сумма до')
+    q = forms.CharField(required=False, max_length=200, label='Комментарий или категория')
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('user')
+        super(TransactionFilterForm, self).__init__(*args, **kwargs)
+        self.fields['account'].queryset = Account.objects.filter(user=self.user).only('id', 'name') \
+            .order_by('name', 'id')
+
+    def filter(self, queryset):
+        data = self.cleaned_data
+        if data.get('account'):
+            queryset = queryset.filter(Q(from_account=data['account']) | Q(to_account=data['account']))
+        if data.get('date_from'):
+            queryset = queryset.filter(date__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(date__lte=data['date_to'])
+        if data.get('amount_min') is not None:
+            queryset = queryset.filter(amount__gte=data['amount_min'])
+        if data.get('amount_max') is not None:
+            queryset = queryset.filter(amount__lte=data['amount_max'])
+        if data.get('q'):
+            queryset = filter_matching(queryset, self.user, data['q'])
+        return queryset
@@ -0,0 +1,218 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import router, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from users.budgets import apply_budget_deltas, budget_deltas
+from users.models import Account, AccountBalanceSnapshot, CategoryModel, MonthlyCategoryTotal, Transaction
+from users.signals import transactions_bulk_created
+
+ZERO = Decimal('0')
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+STATE_FIELDS = ('user_id', 'from_account_id', 'to_account_id', 'category_id', 'amount', 'date')
+
+
+def transaction_state(record):
+    state = {field: getattr(record, field) for field in STATE_FIELDS}
+    state['date'] = _as_date(state['date'])
+    return state
+
+
+def _merge(*deltas):
+    merged = defaultdict(int)
+    for delta in deltas:
+        for key, value in delta.items():
+            merged[key] += value
+    return {key: value for key, value in merged.items() if value}
+
+
+def balance_deltas(states, sign=1):
+    deltas = defaultdict(Decimal)
+    for state in states:
+        amount = Decimal(state['amount']) * sign
+        deltas[(state['from_account_id'], state['date'])] -= amount
+        deltas[(state['to_account_id'], state['date'])] += amount
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def apply_balance_deltas(deltas, create=True):
+    # При удалении операции строка за ее день уже существует. Новые строки не
+    # создаются, чтобы каскадное удаление счета не оставляло после себя снимков.
+    snapshots = AccountBalanceSnapshot.objects
+    with transaction.atomic(using=router.db_for_write(AccountBalanceSnapshot)):
+        for (account_id, date), delta in sorted(deltas.items()):
+            if create and not snapshots.filter(account_id=account_id, date=date).exists():
+                previous = snapshots.filter(account_id=account_id, date__lt=date).order_by('-date') \
+                    .values_list('cumulative_change', flat=True).first()
+                snapshots.create(account_id=account_id, date=date, cumulative_change=previous or ZERO)
+            snapshots.filter(account_id=account_id, date=date).update(change=F('change') + delta)
+            snapshots.filter(account_id=account_id, date__gte=date) \
+                .update(cumulative_change=F('cumulative_change') + delta)
+
+
+def category_deltas(states, sign=1):
+    totals = defaultdict(Decimal)
+    counts = defaultdict(int)
+    for state in states:
+        if state['category_id'] is None:
+            continue
+        key = (state['user_id'], state['date'].replace(day=1), state['category_id'])
+        totals[key] += Decimal(state['amount']) * sign
+        counts[key] += sign
+    return totals, counts
+
+
+def apply_category_deltas(totals, counts, create=True):
+    rollups = MonthlyCategoryTotal.objects
+    with transaction.atomic(using=router.db_for_write(MonthlyCategoryTotal)):
+        for user_id, month, category_id in sorted(set(totals) | set(counts)):
+            filters = {'user_id': user_id, 'month': month, 'category_id': category_id}
+            updates = {
+                'total': F('total') + totals.get((user_id, month, category_id), ZERO),
+                'count': F('count') + counts.get((user_id, month, category_id), 0),
+            }
+            if rollups.filter(**filters).update(**updates) or not create:
+                continue
+            key = CategoryModel.objects.filter(pk=category_id).values_list('key', flat=True).first()
+            if key is None:
+                continue
+            rollups.get_or_create(key=key, **filters)
+            rollups.filter(**filters).update(**updates)
+
+
+def apply_changes(created=(), removed=(), create=True):
+    created = [transaction_state(record) if isinstance(record, Transaction) else record for record in created]
+    removed = [transaction_state(record) if isinstance(record, Transaction) else record for record in removed]
+    apply_balance_deltas(_merge(balance_deltas(created), balance_deltas(removed, sign=-1)), create=create)
+    new_totals, new_counts = category_deltas(created)
+    old_totals, old_counts = category_deltas(removed, sign=-1)
+    apply_category_deltas(_merge(new_totals, old_totals), _merge(new_counts, old_counts), create=create)
+    apply_budget_deltas(_merge(budget_deltas(created), budget_deltas(removed, sign=-1)))
+
+
+def transactions_created(sender, records, **kwargs):
+    apply_changes(created=records)
+
+
+def _cumulative_change(snapshots):
+    return snapshots.order_by('-date').values_list('cumulative_change', flat=True).first() or ZERO
+
+
+def _opening_balance(account_id):
+    # Баланс счета без учета всех операций журнала.
+    balance = Account.objects.filter(pk=account_id).values_list('balance', flat=True).get()
+    return balance - _cumulative_change(AccountBalanceSnapshot.objects.filter(account_id=account_id))
+
+
+def balance_on(account, date):
+    account_id = getattr(account, 'pk', account)
+    snapshots = AccountBalanceSnapshot.objects.filter(account_id=account_id, date__lte=date)
+    return _opening_balance(account_id) + _cumulative_change(snapshots)
+
+
+def balance_history(account, start, end):
+    """Список (дата, баланс) на начало периода и на каждый день с операциями внутри него."""
+    account_id = getattr(account, 'pk', account)
+    opening = _opening_balance(account_id)
+    snapshots = AccountBalanceSnapshot.objects.filter(account_id=account_id)
+    history = [(start, opening + _cumulative_change(snapshots.filter(date__lte=start)))]
+    for date, cumulative in snapshots.filter(date__gt=start, date__lte=end).order_by('date') \
+            .values_list('date', 'cumulative_change'):
+        history.append((date, opening + cumulative))
+    return history
+
+
+def rebuild_balance_snapshots(account_ids=None, batch_size=1000):
+    sent = Transaction.objects.values('from_account_id', 'date').annotate(total=Sum('amount'))
+    received = Transaction.objects.values('to_account_id', 'date').annotate(total=Sum('amount'))
+    snapshots = AccountBalanceSnapshot.objects.all()
+    if account_ids is not None:
+        sent = sent.filter(from_account_id__in=account_ids)
+        received = received.filter(to_account_id__in=account_ids)
+        snapshots = snapshots.filter(account_id__in=account_ids)
+
+    changes = defaultdict(Decimal)
+    for row in sent.order_by():
+        changes[(row['from_account_id'], row['date'])] -= row['total']
+    for row in received.order_by():
+        changes[(row['to_account_id'], row['date'])] += row['total']
+
+    rows = []
+    cumulative = ZERO
+    current_account = None
+    for (account_id, date), change in sorted(changes.items()):
+        if account_id != current_account:
+            current_account, cumulative = account_id, ZERO
+        cumulative += change
+        rows.append(AccountBalanceSnapshot(account_id=account_id, date=date, change=change,
+                                           cumulative_change=cumulative))
+    with transaction.atomic(using=snapshots.db):
+        snapshots.delete()
+        AccountBalanceSnapshot.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def rebuild_category_totals(user_ids=None, batch_size=1000):
+    month = TruncMonth('date', output_field=DateField())
+    rows = Transaction.objects.filter(category__isnull=False)
+    totals = MonthlyCategoryTotal.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+        totals = totals.filter(user_id__in=user_ids)
+    rows = rows.annotate(month=month).values('user_id', 'month', 'category_id', 'category__key') \
+        .annotate(total=Sum('amount'), count=Count('id')).order_by()
+    with transaction.atomic(using=totals.db):
+        totals.delete()
+        MonthlyCategoryTotal.objects.bulk_create(
+            (MonthlyCategoryTotal(user_id=row['user_id'], month=row['month'], category_id=row['category_id'],
+                                  key=row['category__key'], total=row['total'], count=row['count'])
+             for row in rows.iterator()),
+            batch_size=batch_size,
+        )
+
+
+def category_totals(user, start, end):
+    """Суммы по категориям за месяцы [start, end]: не более 12 x категорий строк за год."""
+    return MonthlyCategoryTotal.objects.filter(user=user, month__gte=start.replace(day=1), month__lte=end) \
+        .values('category_id', 'category__category_name', 'key') \
+        .annotate(total=Sum('total'), count=Sum('count')).order_by('key', '-total')
+
+
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    instance._ledger_previous = None
+    if instance.pk and not raw:
+        instance._ledger_previous = Transaction.objects.filter(pk=instance.pk).values(*STATE_FIELDS).first()
+
+
+def transaction_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_ledger_previous', None)
+    apply_changes(created=[instance], removed=[previous] if previous else [])
+
+
+def transaction_deleted(sender, instance, **kwargs):
+    apply_changes(removed=[instance], create=False)
+
+
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        MonthlyCategoryTotal.objects.filter(category=instance).exclude(key=instance.key).update(key=instance.key)
+
+
+pre_save.connect(remember_previous_state, sender=Transaction)
+post_save.connect(transaction_saved, sender=Transaction)
+post_delete.connect(transaction_deleted, sender=Transaction)
+post_save.connect(category_saved, sender=CategoryModel)
+transactions_bulk_created.connect(transactions_created)
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from users.cache import invalidate_user
+from users.models import CategoryModel, Account
+from users.sharding import user_shards
+from users.storage import icon_storage
+from users.thumbnails import thumbnail_from_path, ICON_EXTENSION
+
+ICON_MODELS = (CategoryModel, Account)
+
+
+def _render(name):
+    # Выполняется в дочернем процессе: только декодирование и сжатие, без обращений к базе.
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    try:
+        return name, thumbnail_from_path(path), None
+    except Exception as e:
+        return name, None, f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = 'Заменяет иконки, сохраненные до появления миниатюр, на миниатюры WebP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Количество процессов для обработки изображений')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, какие иконки будут обработаны')
+
+    def handle(self, *args, **options):
+        names = set()
+        for alias in user_shards():
+            for model in ICON_MODELS:
+                names.update(model.objects.using(alias).values_list('icon', flat=True).distinct())
+        pending = sorted(name for name in names if name and not icon_storage.is_normalized(name))
+        if options['dry_run']:
+            for name in pending:
+                self.stdout.write(name)
+            return
+
+        converted = failed = 0
+        with ProcessPoolExecutor(max_workers=max(options['workers'] or 1, 1)) as executor:
+            for name, data, error in executor.map(_render, pending, chunksize=8):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                blob = icon_storage.store(os.path.splitext(name)[0] + ICON_EXTENSION, ContentFile(data))
+                for alias in user_shards():
+                    for model in ICON_MODELS:
+                        rows = model.objects.using(alias).filter(icon=name)
+                        user_ids = list(rows.values_list('user_id', flat=True).distinct())
+                        rows.update(icon=blob)
+                        for user_id in user_ids:
+                            invalidate_user(user_id)
+                converted += 1
+                self.stdout.write(f'{name} -> {blob}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано иконок: {converted}, с ошибками: {failed}. '
+            f'Старые файлы удалит manage.py gc_icons'
+        ))
@@ -0,0 +1,84 @@
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from users.analytics import compute_analytics, get_analytics
+from users.management.commands.bench_endpoints import Command as BenchEndpoints
+from users.models import CategoryModel, Transaction
+from users.sharding import use_user_shard
+
+
+def orm_monthly_totals(user):
+    """То же, что users.analytics, построчным обходом моделей: эталон для сравнения."""
+    income = defaultdict(Decimal)
+    expenses = defaultdict(Decimal)
+    for record in Transaction.objects.filter(user=user, category__isnull=False).select_related('category'):
+        month = record.date.strftime('%Y-%m')
+        if record.category.key == CategoryModel.INCOME:
+            income[month] += record.amount
+        else:
+            expenses[month] += record.amount
+    return income, expenses
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает users.analytics (NumPy) с построчным обходом операций через ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - с наибольшим числом операций')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = BenchEndpoints.get_user(options['user'])
+        with use_user_shard(user):
+            self.bench(user, options['repeat'])
+
+    def bench(self, user, repeat):
+        count = Transaction.objects.filter(user=user).count()
+        self.stdout.write(f'{user.email}: операций {count}')
+
+        orm = self.timed(lambda: orm_monthly_totals(user), repeat)
+        vectorized = self.timed(lambda: compute_analytics(user), repeat)
+        get_analytics(user)
+        cached = self.timed(lambda: get_analytics(user), repeat)
+
+        client = Client()
+        client.force_login(user)
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            cache.clear()
+            page_cold = self.timed(lambda: client.get(reverse('analytics')), 1)
+            page = self.timed(lambda: client.get(reverse('analytics')), repeat)
+
+        for name, elapsed in (('ORM, построчно', orm), ('NumPy', vectorized), ('NumPy из кэша', cached),
+                              ('Страница, холодный кэш', page_cold), ('Страница', page)):
+            self.stdout.write(f'{name:<24} {elapsed * 1000:>10.2f} мс')
+
+        income, expenses = orm_monthly_totals(user)
+        data = compute_analytics(user)
+        mismatched = [
+            month for position, month in enumerate(data['months'])
+            if abs(float(income.get(month, 0)) - data['income'][position]) > 0.01
+            or abs(float(expenses.get(month, 0)) - data['expenses'][position]) > 0.01
+        ]
+        if mismatched:
+            raise CommandError(f'Результаты расходятся за месяцы: {", ".join(mismatched)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты совпадают, ускорение {orm / vectorized:.0f}x ({timezone.localdate()})'
+        ))
+
+    @staticmethod
+    def timed(func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
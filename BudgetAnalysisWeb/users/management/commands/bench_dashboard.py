@@ -0,0 +1,142 @@
+import asyncio
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db.backends.utils import CursorWrapper
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from users.dashboard import SECTIONS, dashboard_workers
+from users.management.commands.bench_endpoints import Command as BenchEndpoints
+from users.metrics import percentile
+from users.sharding import use_user_shard
+
+
+class AsgiDriver:
+    """Вызывает BudgetAnalysisWeb.asgi.application так же, как это делает ASGI-сервер (uvicorn, daphne)."""
+
+    def __init__(self, cookies):
+        from BudgetAnalysisWeb.asgi import application
+        self.application = application
+        self.cookie = '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())
+        self.loop = asyncio.new_event_loop()
+
+    def close(self):
+        self.loop.close()
+
+    def get(self, path):
+        return self.loop.run_until_complete(self.request(path))
+
+    async def request(self, path):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            'headers': [(b'host', b'localhost'), (b'cookie', self.cookie.encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application(scope, receive, send)
+        status = next(message['status'] for message in messages if message['type'] == 'http.response.start')
+        size = sum(len(message.get('body', b'')) for message in messages if message['type'] == 'http.response.body')
+        return status, size
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает главную страницу с параллельной загрузкой разделов и с последовательной '
+            '(DASHBOARD_WORKERS = 0) через asgi.application')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - с наибольшим числом операций')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--workers', type=int, help='Потоков для параллельной загрузки, '
+                                                        'по умолчанию DASHBOARD_WORKERS или 4')
+        parser.add_argument('--query-latency', type=float, default=0,
+                            help='Задержка в мс перед каждым SQL-запросом: имитирует сетевую базу '
+                                 '(PostgreSQL на другом сервере) вместо локального файла SQLite')
+
+    def handle(self, *args, **options):
+        user = BenchEndpoints.get_user(options['user'])
+        workers = options['workers'] or dashboard_workers() or 4
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Уже вызвано, например при запуске из тестов.
+            pass
+        client = Client()
+        client.force_login(user)
+
+        with ExitStack() as stack:
+            if options['query_latency']:
+                stack.enter_context(self.network_latency(options['query_latency'] / 1000))
+            self.bench(user, client, workers, options)
+
+    def bench(self, user, client, workers, options):
+        sections = self.time_sections(user, options['iterations'])
+        self.stdout.write(f'{user.email}, разделы (p50): ' +
+                          ', '.join(f'{name} {value:.2f} мс' for name, value in sections.items()))
+        self.stdout.write(f'Сумма: {sum(sections.values()):.2f} мс, самый долгий: {max(sections.values()):.2f} мс')
+
+        driver = AsgiDriver(client.cookies)
+        results = {}
+        try:
+            with override_settings(ALLOWED_HOSTS=['localhost', 'testserver'], DEBUG=False):
+                for name, value in (('sequential', 0), ('concurrent', workers)):
+                    with override_settings(DASHBOARD_WORKERS=value):
+                        results[name] = self.measure(driver, reverse('main'), options)
+                    self.stdout.write(f"asgi:main {name:<11} p50 {results[name]['p50']:>8.2f} мс  "
+                                      f"p90 {results[name]['p90']:>8.2f} мс  [{results[name]['status']}]")
+        finally:
+            driver.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ускорение p50: {results['sequential']['p50'] / results['concurrent']['p50']:.2f}x "
+            f"({workers} потоков)"
+        ))
+
+    @staticmethod
+    def network_latency(seconds):
+        # Ожидание ответа сервера базы отпускает GIL так же, как time.sleep.
+        execute = CursorWrapper.execute
+
+        def delayed(self, sql, params=None):
+            time.sleep(seconds)
+            return execute(self, sql, params)
+        return mock.patch.object(CursorWrapper, 'execute', delayed)
+
+    @staticmethod
+    def time_sections(user, iterations):
+        today = timezone.localdate()
+        result = {}
+        with use_user_shard(user):
+            for name, loader in SECTIONS.items():
+                latencies = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    loader(user, today)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                result[name] = percentile(sorted(latencies), 50)
+        return result
+
+    @staticmethod
+    def measure(driver, path, options):
+        for _ in range(options['warmup']):
+            driver.get(path)
+        latencies = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            status, _ = driver.get(path)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        return {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90), 'status': status}
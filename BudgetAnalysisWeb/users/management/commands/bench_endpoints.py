@@ -0,0 +1,195 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, reset_queries
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+
+from users.metrics import PERCENTILES, percentile
+from users.models import Transaction
+from users.sharding import all_databases
+
+User = get_user_model()
+
+# Разница меньше этой считается шумом измерения даже при росте в процентах.
+MIN_LATENCY_DELTA_MS = 1.0
+
+BENCH_URLS = (
+    'main', 'profile', 'category_list', 'accounts', 'account_autocomplete', 'transfer', 'statement_upload',
+    'transaction_history', 'transaction_history_json', 'export_transactions',
+)
+
+
+class WsgiDriver:
+    """Вызывает BudgetAnalysisWeb.wsgi.application так же, как это делает WSGI-сервер."""
+
+    def __init__(self, cookies):
+        from BudgetAnalysisWeb.wsgi import application
+        self.application = application
+        self.cookie = '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())
+
+    def get(self, path):
+        path, _, query = path.partition('?')
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_COOKIE': self.cookie,
+                   'SERVER_NAME': 'localhost', 'HTTP_HOST': 'localhost', 'wsgi.input': BytesIO()}
+        setup_testing_defaults(environ)
+        status = []
+        body = self.application(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+        try:
+            size = sum(len(chunk) for chunk in body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return int(status[0].split()[0]), size
+
+
+class ClientDriver:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, path):
+        response = self.client.get(path)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, len(content)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и память по основным страницам через тестовый клиент '
+            'и wsgi.application; сохраняет результат в JSON и сравнивает его с базовым')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - пользователь с наибольшим '
+                                           'числом операций (см. seed_perf)')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--drivers', default='client,wsgi', help='client, wsgi или оба через запятую')
+        parser.add_argument('--output', help='Куда сохранить результаты (JSON)')
+        parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимый рост задержки p50 и памяти относительно базового прогона')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Уже вызвано, например при запуске из тестов.
+            pass
+        client = Client()
+        client.force_login(user)
+        drivers = {
+            'client': lambda: ClientDriver(client),
+            'wsgi': lambda: WsgiDriver(client.cookies),
+        }
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['localhost', 'testserver'], DEBUG=False):
+            for driver_name in options['drivers'].split(','):
+                driver = drivers[driver_name.strip()]()
+                for url_name in BENCH_URLS:
+                    key = f'{driver_name}:{url_name}'
+                    results[key] = self.measure(driver, reverse(url_name), options)
+                    self.report(key, results[key])
+
+        data = {
+            'meta': {
+                'user': user.email, 'iterations': options['iterations'], 'python': platform.python_version(),
+                'databases': {alias: str(db['NAME']) for alias, db in settings.DATABASES.items()},
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'endpoints': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    @staticmethod
+    def get_user(email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist as e:
+                raise CommandError(e)
+        # Операции пользователя лежат в его шарде, поэтому самый активный ищется по всем базам.
+        busiest = max((
+            row for alias in all_databases()
+            for row in Transaction.objects.using(alias).order_by().values('user_id')
+            .annotate(count=Count('id')).order_by('-count').values_list('count', 'user_id')[:1]
+        ), default=None)
+        user = User.objects.filter(pk=busiest[1]).first() if busiest else User.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей: сначала выполните manage.py seed_perf')
+        return user
+
+    @staticmethod
+    def measure(driver, path, options):
+        for _ in range(options['warmup']):
+            driver.get(path)
+        latencies = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            status, size = driver.get(path)
+            latencies.append((time.perf_counter() - started) * 1000)
+        reset_queries()
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+            driver.get(path)
+        # captured_queries читает журнал соединения, а следующий запрос его очистит.
+        queries = sum(len(context) for context in captured)
+        # Память замеряется отдельным запросом: tracemalloc заметно замедляет выполнение.
+        tracemalloc.start()
+        try:
+            driver.get(path)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        latencies.sort()
+        result = {f'p{percent}_ms': round(percentile(latencies, percent), 2) for percent in PERCENTILES}
+        result.update({
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'queries': queries,
+            'peak_memory_kb': round(peak / 1024, 1),
+            'status': status,
+            'bytes': size,
+        })
+        return result
+
+    def report(self, key, result):
+        self.stdout.write(
+            f"{key:<40} p50 {result['p50_ms']:>8.2f} мс  p90 {result['p90_ms']:>8.2f} мс  "
+            f"p99 {result['p99_ms']:>8.2f} мс  запросов {result['queries']:>3}  "
+            f"память {result['peak_memory_kb']:>8.1f} КБ  [{result['status']}]"
+        )
+
+    def compare(self, results, path, tolerance):
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)['endpoints']
+        regressions = []
+        for key, result in results.items():
+            before = baseline.get(key)
+            if before is None:
+                continue
+            if result['queries'] > before['queries']:
+                regressions.append(f"{key}: запросов {before['queries']} -> {result['queries']}")
+            if result['p50_ms'] > max(before['p50_ms'] * (1 + tolerance), before['p50_ms'] + MIN_LATENCY_DELTA_MS):
+                regressions.append(f"{key}: p50 {before['p50_ms']} -> {result['p50_ms']} мс")
+            if result['peak_memory_kb'] > before['peak_memory_kb'] * (1 + tolerance):
+                regressions.append(f"{key}: память {before['peak_memory_kb']} -> {result['peak_memory_kb']} КБ")
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f'Регрессий относительно {path}: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS(f'Регрессий относительно {path} нет'))
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from users.management.commands.bench_endpoints import Command as BenchEndpoints
+from users.models import Transaction
+from users.search import filter_matching, search_supported, search_transactions, search_terms, SEARCH_LIMIT
+from users.sharding import use_user_shard
+
+# Последний запрос ничего не находит: худший случай для LIKE, который проходит все операции.
+DEFAULT_QUERIES = ('такси', 'апт', 'кафе продукты', 'перевод', 'отпуск')
+
+
+def like_scan(user, text, limit=SEARCH_LIMIT):
+    """Поиск до FTS5: LIKE '%слово%' по всем операциям пользователя."""
+    queryset = Transaction.objects.filter(user=user).select_related('from_account', 'to_account', 'category')
+    for term in search_terms(text):
+        queryset = queryset.filter(Q(comment__icontains=term) | Q(category__category_name__icontains=term))
+    return list(queryset.order_by('-date', '-id')[:limit])
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск по индексу FTS5 с LIKE по всем операциям пользователя'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - с наибольшим числом операций')
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='Поисковая строка; можно указать несколько раз')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = BenchEndpoints.get_user(options['user'])
+        with use_user_shard(user):
+            if not search_supported(Transaction.objects.all().db):
+                raise CommandError('Полнотекстовый индекс есть только в SQLite')
+            self.stdout.write(f'{user.email}: операций {Transaction.objects.filter(user=user).count()}')
+            self.stdout.write(f'{"Запрос":<16} {"найдено":>8} {"LIKE":>10} {"FTS5":>10} {"фильтр":>10}')
+            for text in options['queries'] or DEFAULT_QUERIES:
+                self.bench(user, text, options['repeat'])
+
+    def bench(self, user, text, repeat):
+        queryset = Transaction.objects.filter(user=user)
+        found = filter_matching(queryset, user, text).count()
+        like = self.timed(lambda: like_scan(user, text), repeat)
+        fts = self.timed(lambda: search_transactions(user, text), repeat)
+        # Фильтр истории: совпадения FTS5 в порядке даты, первая страница.
+        history = self.timed(lambda: list(filter_matching(queryset, user, text).order_by('-date', '-id')[:50]),
+                             repeat)
+        self.stdout.write(f'{text:<16} {found:>8} {like * 1000:>7.2f} мс {fts * 1000:>7.2f} мс '
+                          f'{history * 1000:>7.2f} мс')
+
+    @staticmethod
+    def timed(func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
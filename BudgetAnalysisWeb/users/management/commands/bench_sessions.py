@@ -0,0 +1,86 @@
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+
+from users.management.commands.bench_endpoints import Command as BenchEndpoints
+from users.metrics import percentile
+
+# Сессии и пользователь для request.user: как было (db + ModelBackend) и варианты с кэшем.
+CONFIGS = {
+    'db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    'cached_db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'AUTHENTICATION_BACKENDS': ['users.backends.CachedModelBackend'],
+    },
+    'signed_cookies': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+        'AUTHENTICATION_BACKENDS': ['users.backends.CachedModelBackend'],
+    },
+}
+FIXED_TABLES = ('"django_session"', '"users_user"')
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает постоянные расходы запроса страницы (сессия и request.user) '
+            'при сессиях в базе, в кэше с записью в базу и в подписанной cookie')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - с наибольшим числом операций')
+        parser.add_argument('--url', default='accounts', help='Имя URL страницы')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+
+    def handle(self, *args, **options):
+        user = BenchEndpoints.get_user(options['user'])
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Уже вызвано, например при запуске из тестов.
+            pass
+        path = reverse(options['url'])
+        results = {}
+        for name, config in CONFIGS.items():
+            with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False, **config):
+                # Клиент собирает middleware при первом запросе, поэтому для каждой настройки - новый.
+                client = Client()
+                client.force_login(user)
+                results[name] = self.measure(client, path, options)
+            result = results[name]
+            self.stdout.write(f"{name:<15} p50 {result['p50']:>7.2f} мс  p90 {result['p90']:>7.2f} мс  "
+                              f"запросов {result['queries']:>2} (сессия и пользователь: {result['fixed']})  "
+                              f"[{result['status']}]")
+        saved = results['db']['p50'] - results['cached_db']['p50']
+        self.stdout.write(self.style.SUCCESS(
+            f"cached_db быстрее db на {saved:.2f} мс на запрос, "
+            f"{results['db']['fixed'] - results['cached_db']['fixed']} запроса к базе меньше"
+        ))
+
+    @staticmethod
+    def measure(client, path, options):
+        for _ in range(options['warmup']):
+            client.get(path)
+        latencies = []
+        for _ in range(options['iterations']):
+            started = time.perf_counter()
+            response = client.get(path)
+            latencies.append((time.perf_counter() - started) * 1000)
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+            client.get(path)
+        queries = [query['sql'] for context in captured for query in context.captured_queries]
+        latencies.sort()
+        return {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'queries': len(queries),
+            'fixed': sum(1 for sql in queries if any(f'FROM {table}' in sql for table in FIXED_TABLES)),
+            'status': response.status_code,
+        }
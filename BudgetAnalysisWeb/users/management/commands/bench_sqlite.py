@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+import uuid
+from contextvars import copy_context
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, OperationalError
+from django.test.utils import override_settings
+
+from users.db import SQLITE_PRAGMAS
+from users.models import Account, Transaction
+from users.pagination import keyset_page
+from users.sharding import use_user_shard
+from users.transfers import apply_transfer, InsufficientFundsError
+
+User = get_user_model()
+
+# Настройки SQLite по умолчанию, с которыми работал проект до users.db.
+BASELINE_PRAGMAS = {name: None for name in SQLITE_PRAGMAS}
+BASELINE_PRAGMAS.update({'journal_mode': 'DELETE', 'synchronous': 'FULL'})
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность параллельных чтений и записей без настроек SQLite и с ними'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5.0, help='Длительность каждого прогона, с')
+        parser.add_argument('--accounts', type=int, default=10)
+        parser.add_argument('--profile', choices=('baseline', 'tuned', 'both'), default='both')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Тест предназначен для SQLite')
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(username=f'bench-{tag}', email=f'bench-{tag}@example.com')
+        with use_user_shard(user):
+            self.bench(user, options)
+
+    def bench(self, user, options):
+        Account.objects.bulk_create(
+            Account(user=user, name=f'bench {i}', balance=Decimal('1000000.00')) for i in range(options['accounts'])
+        )
+        account_ids = list(Account.objects.filter(user=user).values_list('pk', flat=True))
+
+        profiles = ('baseline', 'tuned') if options['profile'] == 'both' else (options['profile'],)
+        try:
+            for profile in profiles:
+                pragmas = BASELINE_PRAGMAS if profile == 'baseline' else {}
+                with override_settings(SQLITE_PRAGMAS=pragmas):
+                    connections.close_all()
+                    result = self.run(user, account_ids, options)
+                connections.close_all()
+                self.stdout.write(
+                    f"{profile:>8}: чтений {result['reads'] / result['elapsed']:.0f}/с, "
+                    f"записей {result['writes'] / result['elapsed']:.0f}/с, "
+                    f"ошибок блокировки {result['locked']}"
+                )
+        finally:
+            # Режим журнала хранится в самом файле базы, возвращаем рабочий.
+            connections.close_all()
+            connection.ensure_connection()
+            user.delete()
+
+    def run(self, user, account_ids, options):
+        stats = {'reads': 0, 'writes': 0, 'locked': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def reader():
+            reads = locked = 0
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        list(Account.objects.filter(user=user).values_list('name', 'balance'))
+                        keyset_page(Transaction.objects.filter(user=user), size=50)
+                        reads += 1
+                    except OperationalError:
+                        locked += 1
+            finally:
+                connections.close_all()
+            with lock:
+                stats['reads'] += reads
+                stats['locked'] += locked
+
+        def writer(seed):
+            rng = random.Random(seed)
+            writes = locked = 0
+            try:
+                while time.monotonic() < deadline:
+                    from_id, to_id = rng.sample(account_ids, 2)
+                    try:
+                        apply_transfer(user, from_id, to_id, Decimal(rng.randint(1, 5000)) / 100)
+                        writes += 1
+                    except InsufficientFundsError:
+                        pass
+                    except OperationalError:
+                        locked += 1
+            finally:
+                connections.close_all()
+            with lock:
+                stats['writes'] += writes
+                stats['locked'] += locked
+
+        threads = [threading.Thread(target=copy_context().run, args=(reader,)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=copy_context().run, args=(writer, seed))
+                    for seed in range(options['writers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats['elapsed'] = time.monotonic() - started
+        return stats
@@ -0,0 +1,101 @@
+import time
+from copy import deepcopy
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from users.management.commands.bench_endpoints import Command as BenchEndpoints
+from users.metrics import percentile
+
+PAGES = ('main', 'accounts', 'category_list', 'category_create', 'profile', 'analytics',
+         'transaction_history', 'transfer', 'create_account', 'statement_upload')
+UNCACHED_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+CACHED_LOADERS = [('django.template.loaders.cached.Loader', UNCACHED_LOADERS)]
+# Кэш, в котором {% cache %} ничего не хранит: фрагменты рисуются при каждом рендере.
+NO_FRAGMENTS = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+CONFIGS = {
+    'uncached': (UNCACHED_LOADERS, False),
+    'cached_loader': (CACHED_LOADERS, False),
+    'fragments': (CACHED_LOADERS, True),
+}
+
+
+def templates_setting(loaders):
+    templates = deepcopy(settings.TEMPLATES)
+    templates[0]['OPTIONS']['loaders'] = loaders
+    return templates
+
+
+class Command(BaseCommand):
+    help = ('Время рендера шаблона каждой страницы профиля: без кэша шаблонов, с cached loader '
+            'и с cached loader и кэшем фрагментов (меню, сводка по счетам)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя; по умолчанию - с наибольшим числом операций')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = BenchEndpoints.get_user(options['user'])
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Уже вызвано, например при запуске из тестов.
+            pass
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False, DASHBOARD_WORKERS=0):
+            client = Client()
+            client.force_login(user)
+            renders = [self.capture(client, name) for name in PAGES]
+            results = {name: self.measure(renders, *config, options) for name, config in CONFIGS.items()}
+
+        self.stdout.write(f"{'шаблон':<45}" + ''.join(f'{name:>15}' for name in CONFIGS))
+        for template_name, _, _ in renders:
+            self.stdout.write(f'{template_name:<45}' + ''.join(
+                f'{results[name][template_name]:>12.3f} мс' for name in CONFIGS
+            ))
+        totals = {name: sum(result.values()) for name, result in results.items()}
+        self.stdout.write(f"{'всего':<45}" + ''.join(f'{totals[name]:>12.3f} мс' for name in CONFIGS))
+        self.stdout.write(self.style.SUCCESS(
+            f"cached loader быстрее в {totals['uncached'] / totals['cached_loader']:.2f} раза, "
+            f"с фрагментами - в {totals['uncached'] / totals['fragments']:.2f} раза"
+        ))
+
+    @staticmethod
+    def capture(client, url_name):
+        """(имя шаблона, контекст, запрос) из обращения view к render для страницы url_name."""
+        captured = []
+
+        def capturing_render(request, template_name, context=None, *args, **kwargs):
+            captured.append((template_name, context or {}, request))
+            return render(request, template_name, context, *args, **kwargs)
+
+        with mock.patch('users.views.render', capturing_render):
+            response = client.get(reverse(url_name))
+        if response.status_code != 200 or not captured:
+            raise CommandError(f'{url_name}: страница не отрисована (статус {response.status_code})')
+        return captured[-1]
+
+    @staticmethod
+    def measure(renders, loaders, fragments, options):
+        caches = settings.CACHES if fragments else {**settings.CACHES, 'template_fragments': NO_FRAGMENTS}
+        result = {}
+        with override_settings(TEMPLATES=templates_setting(loaders), CACHES=caches):
+            for template_name, context, request in renders:
+                for _ in range(options['warmup']):
+                    render_to_string(template_name, context, request)
+                latencies = []
+                for _ in range(options['iterations']):
+                    started = time.perf_counter()
+                    render_to_string(template_name, context, request)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                result[template_name] = percentile(sorted(latencies), 50)
+        return result
@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+import uuid
+from contextvars import copy_context
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from django.db.models import Sum
+
+from users.models import Account, Transaction
+from users.sharding import use_user_shard
+from users.transfers import apply_transfer, apply_transfers, InsufficientFundsError, Transfer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест переводов: параллельные потоки, проверка отсутствия потерянных обновлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--transfers', type=int, default=200, help='Переводов на один поток')
+        parser.add_argument('--accounts', type=int, default=10)
+        parser.add_argument('--batch', type=int, default=1,
+                            help='Размер пакета для apply_transfers; 1 - по одному переводу')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестового пользователя')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(username=f'bench-{tag}', email=f'bench-{tag}@example.com')
+        with use_user_shard(user):
+            self.bench(user, options)
+
+    def bench(self, user, options):
+        initial = Decimal('1000.00')
+        Account.objects.bulk_create(
+            Account(user=user, name=f'bench {i}', balance=initial) for i in range(options['accounts'])
+        )
+        account_ids = list(Account.objects.filter(user=user).values_list('pk', flat=True))
+        if len(account_ids) < 2:
+            raise CommandError('Нужно как минимум два счета')
+
+        stats = {'applied': 0, 'rejected': 0, 'locked': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            applied = rejected = locked = 0
+            try:
+                for _ in range(options['transfers'] // options['batch']):
+                    batch = []
+                    for _ in range(options['batch']):
+                        from_id, to_id = rng.sample(account_ids, 2)
+                        batch.append(Transfer(from_id, to_id, Decimal(rng.randint(1, 5000)) / 100))
+                    try:
+                        if len(batch) == 1:
+                            apply_transfer(user, *batch[0][:3])
+                        else:
+                            apply_transfers(user, batch)
+                        applied += len(batch)
+                    except InsufficientFundsError:
+                        rejected += len(batch)
+                    except OperationalError:
+                        locked += len(batch)
+            finally:
+                connections.close_all()
+            with lock:
+                stats['applied'] += applied
+                stats['rejected'] += rejected
+                stats['locked'] += locked
+
+        # Каждый поток получает свою копию контекста с шардой пользователя.
+        threads = [threading.Thread(target=copy_context().run, args=(worker, seed))
+                   for seed in range(options['workers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        lost = self.check_consistency(user, account_ids, initial)
+        self.stdout.write(
+            f"Потоков: {options['workers']}, применено: {stats['applied']}, отклонено: {stats['rejected']}, "
+            f"ошибок блокировки: {stats['locked']}, {elapsed:.2f} с, {stats['applied'] / elapsed:.0f} переводов/с"
+        )
+        if not options['keep']:
+            user.delete()
+        if lost:
+            raise CommandError(f'Потерянные обновления на счетах: {lost}')
+        self.stdout.write(self.style.SUCCESS('Потерянных обновлений нет'))
+
+    @staticmethod
+    def check_consistency(user, account_ids, initial):
+        sent = dict(Transaction.objects.filter(user=user).values('from_account')
+                    .annotate(total=Sum('amount')).values_list('from_account', 'total'))
+        received = dict(Transaction.objects.filter(user=user).values('to_account')
+                        .annotate(total=Sum('amount')).values_list('to_account', 'total'))
+        lost = []
+        for account_id, balance in Account.objects.filter(pk__in=account_ids).values_list('pk', 'balance'):
+            expected = initial - sent.get(account_id, 0) + received.get(account_id, 0)
+            if balance != expected or balance < 0:
+                lost.append(account_id)
+        return lost
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.budgets import check_budgets
+from users.sharding import use_database, user_shards
+
+
+class Command(BaseCommand):
+    help = 'Сверяет потраченные суммы бюджетов категорий с журналом операций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='id пользователя; можно указать несколько раз. По умолчанию - все пользователи')
+        parser.add_argument('--fix', action='store_true', help='Пересчитать расходящиеся суммы по журналу')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        mismatched = 0
+        for alias in user_shards():
+            with use_database(alias):
+                for pk, spent, expected in check_budgets(options['users'], fix=options['fix']):
+                    mismatched += 1
+                    self.stdout.write(f'{alias}: бюджет {pk}: {spent} вместо {expected}')
+        elapsed = time.monotonic() - started
+        if mismatched and not options['fix']:
+            raise CommandError(f'Расходится бюджетов: {mismatched}, проверка за {elapsed:.1f} с. '
+                               f'Пересчитать: check_budgets --fix')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено бюджетов: {mismatched} за {elapsed:.1f} с' if mismatched
+            else f'Расхождений нет, проверка за {elapsed:.1f} с'
+        ))
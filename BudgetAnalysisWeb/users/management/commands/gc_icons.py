@@ -0,0 +1,68 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.defaults import default_categories_template
+from users.models import CategoryModel, Account
+from users.sharding import user_shards
+from users.storage import icon_storage
+
+ICON_MODELS = (CategoryModel, Account)
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища иконок файлы, на которые не ссылается ни одна строка'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, какие файлы будут удалены')
+        parser.add_argument('--adopt', action='store_true',
+                            help='Перенести иконки, сохраненные до хранилища по хэшу, в хранилище')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if options['adopt']:
+            self.adopt_legacy_icons(dry_run)
+
+        referenced = self.referenced_names()
+        removed = 0
+        freed = 0
+        for name in icon_storage.blobs():
+            if name in referenced:
+                continue
+            freed += icon_storage.size(name)
+            removed += 1
+            self.stdout.write(f'Удаление {name}')
+            if not dry_run:
+                icon_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {removed}, освобождено байт: {freed}'))
+
+    @staticmethod
+    def referenced_names():
+        names = set()
+        for alias in user_shards():
+            for model in ICON_MODELS:
+                names.update(model.objects.using(alias).values_list('icon', flat=True).distinct())
+        return names
+
+    def adopt_legacy_icons(self, dry_run):
+        protected = {category['icon'] for category in default_categories_template()}
+        legacy = {
+            name for name in self.referenced_names() if name and not name.startswith(icon_storage.prefix + '/')
+        }
+        for name in sorted(legacy):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            if not os.path.isfile(path):
+                self.stderr.write(f'Файл не найден: {name}')
+                continue
+            if dry_run:
+                self.stdout.write(f'Перенос {name}')
+                continue
+            blob = icon_storage.ingest(path)
+            for alias in user_shards():
+                for model in ICON_MODELS:
+                    model.objects.using(alias).filter(icon=name).update(icon=blob)
+            self.stdout.write(f'Перенос {name} -> {blob}')
+            if name not in protected:
+                os.remove(path)
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import Account
+from users.sharding import use_user_shard
+from users.statements import import_statement, parse_statement, detect_format
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Загрузка банковской выписки (CSV/OFX) в операции по счету'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='email пользователя')
+        parser.add_argument('--account', type=int, required=True, help='id счета пользователя')
+        parser.add_argument('--format', choices=('csv', 'ofx'),
+                            help='Формат файла; по умолчанию определяется по расширению')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist as e:
+            raise CommandError(e)
+        with use_user_shard(user):
+            self.import_for(user, options)
+
+    def import_for(self, user, options):
+        try:
+            account = Account.objects.get(pk=options['account'], user=user)
+        except Account.DoesNotExist as e:
+            raise CommandError(e)
+
+        fmt = options['format'] or detect_format(options['path'])
+        errors = []
+        with open(options['path'], encoding='utf-8-sig', newline='') as f:
+            result = import_statement(user, account, parse_statement(f, fmt),
+                                      chunk_size=options['chunk_size'], errors=errors)
+
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {result.created}, дубликатов: {result.duplicates}, с ошибками: {result.invalid}, '
+            f'{result.elapsed:.1f} с, {result.rate:.0f} строк/с'
+        ))
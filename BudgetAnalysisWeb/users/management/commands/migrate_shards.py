@@ -0,0 +1,14 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from users.sharding import all_databases
+
+
+class Command(BaseCommand):
+    help = 'Применяет миграции к основной базе и ко всем шардам из USER_SHARDS'
+
+    def handle(self, *args, **options):
+        for alias in all_databases():
+            self.stdout.write(f'База {alias}:')
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'],
+                         stdout=self.stdout, stderr=self.stderr)
@@ -0,0 +1,143 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.cache import forget_user, invalidate_user
+from users.ledger import rebuild_balance_snapshots, rebuild_category_totals
+from users.models import UserDataModel, CategoryModel, CategoryBudget, Account, ChangeCounter, RecurringTransaction, \
+    Transaction
+from users.pagination import keyset_iterate
+from users.sharding import forget_shard, hashed_shard, purge_user_data, shard_for, use_database, user_shards
+
+User = get_user_model()
+
+COPY_BATCH_SIZE = 1000
+
+
+def _copy(instance, target, **changes):
+    old_pk = instance.pk
+    instance.pk = None
+    instance._state.adding = True
+    instance._state.db = None
+    for field, value in changes.items():
+        setattr(instance, field, value)
+    instance.save(using=target)
+    return old_pk, instance.pk
+
+
+def move_user(user, target):
+    """
+    Копирует данные пользователя в шарду target, закрепляет ее в User.shard
+    и удаляет данные из старой шарды. Первичные ключи в новой шарде другие.
+    Пока идет перенос, запись данных пользователя завершается UserMovingError.
+    """
+    source = shard_for(user)
+    if source == target:
+        return 0
+    # Флаг ставится до чтения: начатые записи дожидаются его, новые не попадут в старую шарду.
+    ChangeCounter.objects.using(source).update_or_create(user_id=user.pk, defaults={'moving': True})
+    try:
+        moved = _copy_user(user, source, target)
+    except BaseException:
+        ChangeCounter.objects.using(source).filter(user_id=user.pk).update(moving=False)
+        raise
+
+    user.shard = target
+    user.save(update_fields=['shard'])
+    forget_shard(user.pk)
+    purge_user_data(user.pk, source)
+    invalidate_user(user.pk)
+    return moved
+
+
+def _copy_user(user, source, target):
+    profile = UserDataModel.objects.using(source).filter(user=user).first()
+    categories = list(CategoryModel.objects.using(source).filter(user=user))
+    accounts = list(Account.objects.using(source).filter(user=user))
+    rules = list(RecurringTransaction.objects.using(source).filter(user=user))
+    budgets = list(CategoryBudget.objects.using(source).filter(user=user))
+
+    version = ChangeCounter.objects.using(source).filter(user=user).values_list('version', flat=True).first() or 0
+
+    moved = 0
+    with use_database(target), transaction.atomic(using=target):
+        # Номера изменений продолжаются, а курсоры синхронизации, выданные
+        # до переноса, становятся недействительными: id строк будут другими.
+        ChangeCounter.objects.using(target).update_or_create(
+            user_id=user.pk, defaults={'version': version + 1, 'reset_version': version + 1, 'moving': False})
+        category_ids = dict(_copy(category, target) for category in categories)
+        account_ids = dict(_copy(account, target) for account in accounts)
+        if profile is not None:
+            _copy(profile, target)
+        for rule in rules:
+            _copy(rule, target, from_account_id=account_ids[rule.from_account_id],
+                  to_account_id=account_ids[rule.to_account_id], category_id=category_ids.get(rule.category_id))
+        batch = []
+        for record in keyset_iterate(Transaction.objects.using(source).filter(user=user), COPY_BATCH_SIZE):
+            batch.append(Transaction(
+                user_id=user.pk,
+                from_account_id=account_ids[record.from_account_id],
+                to_account_id=account_ids[record.to_account_id],
+                amount=record.amount,
+                date=record.date,
+                comment=record.comment,
+                category_id=category_ids.get(record.category_id),
+                import_hash=record.import_hash,
+            ))
+            if len(batch) == COPY_BATCH_SIZE:
+                moved += len(Transaction.objects.using(target).bulk_create(batch))
+                batch = []
+        moved += len(Transaction.objects.using(target).bulk_create(batch))
+        rebuild_balance_snapshots(list(account_ids.values()))
+        rebuild_category_totals([user.pk])
+        # Бюджеты копируются после операций: при сохранении spent пересчитывается по журналу.
+        for budget in budgets:
+            _copy(budget, target, category_id=category_ids[budget.category_id])
+    return moved
+
+
+class Command(BaseCommand):
+    help = ('Перенос пользователей между шардами (USER_SHARDS). Пока пользователь переносится, '
+            'его записи отклоняются с просьбой повторить позже')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='email пользователя, которого нужно перенести')
+        parser.add_argument('--to', help='Шарда назначения для --user')
+        parser.add_argument('--pin', action='store_true',
+                            help='Закрепить за всеми пользователями их текущую шарду. '
+                                 'Выполняется перед изменением USER_SHARDS')
+        parser.add_argument('--rehash', action='store_true',
+                            help='Перенести всех пользователей в шарды по хэшу id для текущего USER_SHARDS')
+
+    def handle(self, *args, **options):
+        if options['pin']:
+            self.pin()
+        if options['user']:
+            if options['to'] not in user_shards():
+                raise CommandError(f"Шарда {options['to']} не указана в USER_SHARDS")
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist as e:
+                raise CommandError(e)
+            self.move(user, options['to'])
+        if options['rehash']:
+            for user in User.objects.order_by('pk').iterator():
+                self.move(user, hashed_shard(user.pk))
+
+    def move(self, user, target):
+        source = shard_for(user)
+        if source == target:
+            return
+        moved = move_user(user, target)
+        self.stdout.write(f'{user.email}: {source} -> {target}, операций: {moved}')
+
+    def pin(self):
+        users = list(User.objects.filter(shard__isnull=True).only('id', 'shard'))
+        for user in users:
+            user.shard = shard_for(user)
+        User.objects.bulk_update(users, ['shard'], batch_size=COPY_BATCH_SIZE)
+        # bulk_update не отправляет post_save: пользователи из кэша забываются здесь.
+        for user in users:
+            forget_shard(user.pk)
+            forget_user(user.pk)
+        self.stdout.write(self.style.SUCCESS(f'Закреплено пользователей: {len(users)}'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.ledger import rebuild_balance_snapshots
+from users.sharding import use_database, user_shards
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные снимки балансов по журналу операций (например, после правок задним числом)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='id счета; можно указать несколько раз. По умолчанию - все счета')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = 0
+        # id счетов уникальны только внутри шарды: --account пересчитывается в каждой.
+        for alias in user_shards():
+            with use_database(alias):
+                count += rebuild_balance_snapshots(options['accounts'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимков создано: {count}, {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.ledger import rebuild_category_totals
+from users.sharding import use_database, user_shards
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает помесячные суммы по категориям по журналу операций'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='id пользователя; можно указать несколько раз. По умолчанию - все пользователи')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        for alias in user_shards():
+            with use_database(alias):
+                rebuild_category_totals(options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Готово за {time.monotonic() - started:.1f} с'))
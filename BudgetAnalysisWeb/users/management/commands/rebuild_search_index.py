@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.search import rebuild_search_index, search_supported
+from users.sharding import use_database, user_shards
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс операций (SQLite FTS5) во всех шардах'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        for alias in user_shards():
+            if not search_supported(alias):
+                raise CommandError(f'{alias}: полнотекстовый индекс есть только в SQLite')
+            with use_database(alias):
+                rows = rebuild_search_index(alias)
+            self.stdout.write(f'{alias}: {rows} операций')
+        self.stdout.write(self.style.SUCCESS(f'Готово за {time.monotonic() - started:.1f} с'))
@@ -0,0 +1,30 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.budgets import rollover_budgets
+from users.sharding import use_database, user_shards
+
+
+class Command(BaseCommand):
+    help = 'Переводит бюджеты категорий, период которых закончился, на текущий период. Запускается раз в день'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Дата запуска в формате ГГГГ-ММ-ДД, по умолчанию сегодня')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Неверная дата: {options['date']}")
+        started = time.monotonic()
+        rolled = 0
+        for alias in user_shards():
+            with use_database(alias):
+                rolled += rollover_budgets(today)
+        self.stdout.write(self.style.SUCCESS(
+            f'Бюджетов переведено на новый период: {rolled} за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import OutboxEmail
+from users.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Обработчик очереди писем: отправляет письма пачками через одно SMTP-соединение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь один раз и выйти')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = deliver_batch(options['batch_size'])
+            processed = sum(stats.values())
+            if processed:
+                self.stdout.write(
+                    f"Отправлено: {stats[OutboxEmail.SENT]}, объединено: {stats[OutboxEmail.COALESCED]}, "
+                    f"отложено: {stats[OutboxEmail.PENDING]}, ошибок: {stats[OutboxEmail.FAILED]}"
+                )
+            if processed < options['batch_size']:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
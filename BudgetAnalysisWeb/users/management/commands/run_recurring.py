@@ -0,0 +1,29 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.recurring import RUN_BATCH_SIZE, run_recurring
+
+
+class Command(BaseCommand):
+    help = 'Создает операции по повторяющимся правилам, срок которых наступил. Запускается раз в день'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Дата запуска в формате ГГГГ-ММ-ДД, по умолчанию сегодня')
+        parser.add_argument('--batch-size', type=int, default=RUN_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Неверная дата: {options['date']}")
+        started = time.monotonic()
+        result = run_recurring(today, options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Правил: {result.rules}, создано операций: {result.created}, уже было: {result.duplicates}, '
+            f'отложено из-за нехватки средств: {result.skipped} за {elapsed:.1f} с'
+        ))
@@ -0,0 +1,161 @@
+import datetime
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.ledger import rebuild_balance_snapshots, rebuild_category_totals
+from users.models import Account, CategoryModel, Transaction, provision_default_categories
+from users.sharding import shard_for, use_database
+from users.statements import EXTERNAL_ACCOUNT_NAME
+
+User = get_user_model()
+
+ACCOUNT_NAMES = ('Карта', 'Наличные', 'Накопительный счет', 'Кредитная карта', 'Вклад', 'Брокерский счет')
+COMMENTS = ('продукты', 'такси', 'кафе', 'аптека', 'подписка', 'подарок', 'коммуналка', 'зарплата', 'перевод')
+PASSWORD = 'perf-password'
+HISTORY_DAYS = 730
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетических пользователей, счета и операции для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--transactions', type=int, default=100000, help='Всего операций на всех пользователей')
+        parser.add_argument('--max-accounts', type=int, default=4, help='Максимум счетов у пользователя, кроме внешнего')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--chunk-users', type=int, default=200, help='Пользователей в одной пачке')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='perf', help='Префикс имен и почты пользователей')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+        # Активность пользователей распределена по Парето: у немногих
+        # большая часть операций, у большинства - по несколько десятков.
+        weights = [rng.paretovariate(1.2) for _ in range(options['users'])]
+        scale = options['transactions'] / sum(weights)
+        volumes = [int(weight * scale) for weight in weights]
+        volumes[0] += options['transactions'] - sum(volumes)
+
+        password = make_password(PASSWORD)
+        created_users = created_transactions = 0
+        for first in range(0, options['users'], options['chunk_users']):
+            numbers = range(first, min(first + options['chunk_users'], options['users']))
+            users = self.create_users(numbers, options['prefix'], options['seed'], password)
+            by_shard = defaultdict(list)
+            for user in users:
+                by_shard[shard_for(user)].append(user)
+            for shard, shard_users in by_shard.items():
+                with use_database(shard):
+                    created_transactions += self.seed_users(
+                        rng, shard, shard_users, {user.pk: volumes[number] for user, number in zip(users, numbers)},
+                        options,
+                    )
+            created_users += len(users)
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Пользователей: {created_users}, операций: {created_transactions}, '
+                              f'{created_transactions / elapsed:.0f} операций/с')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {created_users}, операций: {created_transactions}, '
+            f'{time.monotonic() - started:.1f} с. Пароль пользователей: {PASSWORD}'
+        ))
+
+    @staticmethod
+    def create_users(numbers, prefix, seed, password):
+        emails = [f'{prefix}-{seed}-{number}@example.com' for number in numbers]
+        User.objects.bulk_create(
+            User(username=f'{prefix}-{seed}-{number}', email=email, password=password, email_verify=True)
+            for number, email in zip(numbers, emails)
+        )
+        users = {user.email: user for user in User.objects.filter(email__in=emails).only('id', 'email', 'shard')}
+        ordered = [users[email] for email in emails]
+        provision_default_categories(ordered)
+        return ordered
+
+    def seed_users(self, rng, shard, users, volumes, options):
+        user_ids = [user.pk for user in users]
+        accounts = []
+        for user in users:
+            accounts.append(Account(user=user, name=EXTERNAL_ACCOUNT_NAME, balance=Decimal('0.00'), is_external=True))
+            for name in rng.sample(ACCOUNT_NAMES, rng.randint(1, min(options['max_accounts'], len(ACCOUNT_NAMES)))):
+                accounts.append(Account(user=user, name=name, balance=Decimal(rng.randint(0, 200000))))
+        Account.objects.using(shard).bulk_create(accounts, batch_size=options['batch_size'])
+
+        own_accounts = defaultdict(list)
+        external = {}
+        for pk, user_id, is_external in Account.objects.using(shard).filter(user_id__in=user_ids) \
+                .values_list('pk', 'user_id', 'is_external'):
+            if is_external:
+                external[user_id] = pk
+            else:
+                own_accounts[user_id].append(pk)
+        categories = defaultdict(lambda: defaultdict(list))
+        for pk, user_id, key in CategoryModel.objects.using(shard).filter(user_id__in=user_ids) \
+                .values_list('pk', 'user_id', 'key'):
+            categories[user_id][key].append(pk)
+
+        today = timezone.now().date()
+        balances = dict(Account.objects.using(shard).filter(user_id__in=user_ids).values_list('pk', 'balance'))
+        changes = defaultdict(Decimal)
+        batch = []
+        created = 0
+        for user_id in user_ids:
+            own = own_accounts[user_id]
+            expense_categories = categories[user_id][CategoryModel.EXPENSES]
+            income_categories = categories[user_id][CategoryModel.INCOME]
+            for _ in range(volumes[user_id]):
+                # Недавние операции встречаются чаще давних.
+                date = today - datetime.timedelta(days=min(int(rng.expovariate(1 / 180)), HISTORY_DAYS))
+                source = rng.choice(own)
+                if len(own) == 1 or rng.random() < 0.85:
+                    target = external[user_id]
+                    amount = self.amount(rng.lognormvariate(6.5, 1.1))
+                    category = self.pick(rng, expense_categories)
+                else:
+                    target = rng.choice([pk for pk in own if pk != source])
+                    amount = self.amount(rng.randint(100, 50000))
+                    category = None
+                if balances[source] < amount:
+                    # Как и в переводах, уйти в минус нельзя: вместо расхода приходит доход.
+                    source, target = external[user_id], source
+                    amount = self.amount(rng.lognormvariate(11, 0.3))
+                    category = self.pick(rng, income_categories)
+                balances[source] -= amount
+                balances[target] += amount
+                changes[source] -= amount
+                changes[target] += amount
+                batch.append(Transaction(
+                    user_id=user_id, from_account_id=source, to_account_id=target, amount=amount, date=date,
+                    category_id=category, comment=rng.choice(COMMENTS) if rng.random() < 0.3 else None,
+                ))
+                if len(batch) >= options['batch_size']:
+                    created += len(Transaction.objects.using(shard).bulk_create(batch))
+                    batch = []
+        created += len(Transaction.objects.using(shard).bulk_create(batch))
+
+        Account.objects.using(shard).bulk_update(
+            [Account(pk=pk, balance=balances[pk]) for pk in changes], ['balance'], batch_size=options['batch_size']
+        )
+        rebuild_balance_snapshots(list(balances))
+        rebuild_category_totals(user_ids)
+        return created
+
+    @staticmethod
+    def amount(value):
+        return Decimal(value).quantize(Decimal('0.01'))
+
+    @staticmethod
+    def pick(rng, categories):
+        # Распределение Ципфа: первые категории заметно популярнее остальных.
+        if not categories:
+            return None
+        weights = [1 / rank for rank in range(1, len(categories) + 1)]
+        return rng.choices(categories, weights)[0]
@@ -0,0 +1,122 @@
+import contextlib
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.db import connections
+from django.template.backends.django import Template
+
+# Статистика хранится в памяти процесса: по каждому URL последние ROLLING_WINDOW запросов.
+ROLLING_WINDOW = 1000
+PERCENTILES = (50, 90, 99)
+METRIC_FIELDS = ('total_ms', 'db_ms', 'template_ms', 'queries')
+
+_current = ContextVar('request_metrics', default=None)
+_windows = defaultdict(lambda: deque(maxlen=ROLLING_WINDOW))
+_lock = threading.Lock()
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+    def merge(self, other):
+        # Запросы, выполненные от имени запроса в других потоках (users.dashboard):
+        # время в базе складывается, даже если запросы шли параллельно.
+        self.queries += other.queries
+        self.db_time += other.db_time
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def as_row(self):
+        return self.total_time * 1000, self.db_time * 1000, self.template_time * 1000, self.queries
+
+    def server_timing(self):
+        total, db, template, queries = self.as_row()
+        return f'db;dur={db:.1f};desc="{queries} queries", tpl;dur={template:.1f}, total;dur={total:.1f}'
+
+
+def current_metrics():
+    return _current.get()
+
+
+def activate(metrics):
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+@contextlib.contextmanager
+def track_queries(metrics):
+    """Считает в metrics запросы ко всем базам из текущего потока."""
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.execute_wrapper))
+        yield metrics
+
+
+def record(url_name, metrics):
+    with _lock:
+        _windows[url_name].append(metrics.as_row())
+
+
+def reset():
+    with _lock:
+        _windows.clear()
+
+
+def percentile(values, percent):
+    # Ближайший ранг по отсортированной выборке.
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def snapshot():
+    with _lock:
+        windows = {name: list(rows) for name, rows in _windows.items()}
+    result = {}
+    for name, rows in sorted(windows.items()):
+        stats = {'count': len(rows)}
+        for position, field in enumerate(METRIC_FIELDS):
+            values = sorted(row[position] for row in rows)
+            stats[field] = {f'p{percent}': round(percentile(values, percent), 2) for percent in PERCENTILES}
+            stats[field]['max'] = round(values[-1], 2)
+        result[name] = stats
+    return result
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    metrics = _current.get()
+    if metrics is None:
+        return _template_render(self, context, request)
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context, request)
+    finally:
+        metrics.template_time += time.perf_counter() - started
+
+
+def instrument_templates():
+    # Считается только верхний уровень: {% include %} и {% extends %} рендерятся
+    # внутри него и не проходят через Template бэкенда повторно.
+    Template.render = _timed_render
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from users import metrics
+from users.models import UserMovingError
+from users.sharding import PRIMARY_DATABASE, shard_for, use_database, user_shards
+
+MOVE_RETRY_AFTER = 60
+
+
+def _stream_in_database(chunks, alias):
+    # Потоковый ответ читает базу уже после выхода из middleware.
+    with use_database(alias):
+        yield from chunks
+
+
+class UserShardMiddleware:
+    """Направляет запросы к данным пользователя в его шарду на время обработки запроса."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if user_shards() == [PRIMARY_DATABASE] or not request.user.is_authenticated:
+            return self.get_response(request)
+        alias = shard_for(request.user)
+        with use_database(alias):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = _stream_in_database(response.streaming_content, alias)
+        return response
+
+    def process_exception(self, request, exception):
+        # Запись во время переноса пользователя в другую шарду (rebalance_shards).
+        if isinstance(exception, UserMovingError):
+            response = HttpResponse(exception.messages[0], status=503, content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = str(MOVE_RETRY_AFTER)
+            return response
+        return None
+
+
+class RequestMetricsMiddleware:
+    """
+    Включается настройкой REQUEST_METRICS. Для каждого запроса считает число
+    SQL-запросов, время в базе, время рендеринга шаблонов и общее время,
+    отдает их в заголовке Server-Timing и копит по имени URL для users/metrics/.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        metrics.instrument_templates()
+
+    def __call__(self, request):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.activate(request_metrics)
+        try:
+            with metrics.track_queries(request_metrics):
+                response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        request_metrics.finish()
+        match = request.resolver_match
+        metrics.record(match.url_name if match and match.url_name else '<unresolved>', request_metrics)
+        response['Server-Timing'] = request_metrics.server_timing()
+        return response
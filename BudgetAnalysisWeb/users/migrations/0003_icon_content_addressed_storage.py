@@ -0,0 +1,24 @@
+# Generated by Django 3.2.18 on 2026-10-18 05:18
+
+from django.db import migrations, models
+import users.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_categorymodel_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='icon',
+            field=models.ImageField(storage=users.storage.ContentAddressedStorage(), upload_to='users/static/images/'),
+        ),
+        migrations.AlterField(
+            model_name='categorymodel',
+            name='icon',
+            field=models.ImageField(storage=users.storage.ContentAddressedStorage(), upload_to='users/static/images/'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.18 on 2026-10-18 05:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_icon_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('change', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cumulative_change', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='users.account')),
+            ],
+            options={
+                'unique_together': {('account', 'date')},
+            },
+        ),
+    ]
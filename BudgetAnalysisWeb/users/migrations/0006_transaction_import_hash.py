@@ -0,0 +1,22 @@
+# Generated by Django 3.2.18 on 2026-10-18 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_monthlycategorytotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='transaction',
+            unique_together={('user', 'import_hash')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.18 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_user_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'date', 'category', 'amount'], name='transaction_analytics_idx'),
+        ),
+    ]
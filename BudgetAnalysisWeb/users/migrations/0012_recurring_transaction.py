@@ -0,0 +1,35 @@
+# Generated by Django 3.2.18 on 2026-10-18 05:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import users.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_transaction_analytics_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, validators=[users.validators.positive_number_validator])),
+                ('comment', models.CharField(blank=True, max_length=200, null=True)),
+                ('schedule', models.CharField(max_length=100, validators=[users.validators.schedule_validator])),
+                ('next_run', models.DateField(blank=True, null=True)),
+                ('active', models.BooleanField(default=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recurring_transactions', to='users.categorymodel')),
+                ('from_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recurring_outgoing', to='users.account')),
+                ('to_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recurring_incoming', to='users.account')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recurringtransaction',
+            index=models.Index(condition=models.Q(('active', True)), fields=['next_run', 'id'], name='recurring_due_idx'),
+        ),
+    ]
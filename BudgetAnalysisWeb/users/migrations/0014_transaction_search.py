@@ -0,0 +1,81 @@
+from django.db import migrations
+
+# SQL индекса на момент этой миграции. Текущая версия - в users.search: триггеры
+# оттуда пересоздаются после каждого migrate (users.search.ensure_search_index).
+CREATE_TABLE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_transaction_search USING fts5(
+        owner, comment, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4 5 6 7 8'
+    )
+"""
+INDEXED_ROW = """
+    VALUES (new.id, 'u' || new.user_id,
+            replace(replace(coalesce(new.comment, ''), 'ё', 'е'), 'Ё', 'Е'),
+            replace(replace(coalesce((SELECT category_name FROM users_categorymodel WHERE id = new.category_id), ''),
+                            'ё', 'е'), 'Ё', 'Е'));
+"""
+SEARCH_TRIGGERS = {
+    'users_transaction_search_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_insert AFTER INSERT ON users_transaction BEGIN
+            INSERT INTO users_transaction_search (rowid, owner, comment, category) {INDEXED_ROW}
+        END
+    """,
+    'users_transaction_search_update': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_update
+        AFTER UPDATE OF user_id, comment, category_id ON users_transaction BEGIN
+            DELETE FROM users_transaction_search WHERE rowid = old.id;
+            INSERT INTO users_transaction_search (rowid, owner, comment, category) {INDEXED_ROW}
+        END
+    """,
+    'users_transaction_search_delete': """
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_delete AFTER DELETE ON users_transaction BEGIN
+            DELETE FROM users_transaction_search WHERE rowid = old.id;
+        END
+    """,
+    'users_transaction_search_category': """
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_category
+        AFTER UPDATE OF category_name ON users_categorymodel BEGIN
+            UPDATE users_transaction_search
+            SET category = replace(replace(coalesce(new.category_name, ''), 'ё', 'е'), 'Ё', 'Е')
+            WHERE rowid IN (SELECT id FROM users_transaction WHERE category_id = new.id);
+        END
+    """,
+}
+POPULATE_SQL = """
+    INSERT INTO users_transaction_search (rowid, owner, comment, category)
+    SELECT t.id, 'u' || t.user_id,
+           replace(replace(coalesce(t.comment, ''), 'ё', 'е'), 'Ё', 'Е'),
+           replace(replace(coalesce(c.category_name, ''), 'ё', 'е'), 'Ё', 'Е')
+    FROM users_transaction t LEFT JOIN users_categorymodel c ON c.id = t.category_id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    # На других базах поиск работает через icontains (users.search), индекс не нужен.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    for sql in SEARCH_TRIGGERS.values():
+        schema_editor.execute(sql)
+    schema_editor.execute('DELETE FROM users_transaction_search')
+    schema_editor.execute(POPULATE_SQL)
+    schema_editor.execute("INSERT INTO users_transaction_search (users_transaction_search) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for name in SEARCH_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        schema_editor.execute('DROP TABLE IF EXISTS users_transaction_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_sync_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index, hints={'model_name': 'transaction'}),
+    ]
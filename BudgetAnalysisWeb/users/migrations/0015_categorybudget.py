@@ -0,0 +1,31 @@
+# Generated by Django 3.2.18 on 2026-10-18 06:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import users.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_transaction_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryBudget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('month', 'Месяц'), ('week', 'Неделя')], default='month', max_length=10)),
+                ('limit', models.DecimalField(decimal_places=2, max_digits=10, validators=[users.validators.positive_number_validator])),
+                ('period_start', models.DateField(editable=False)),
+                ('spent', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='budgets', to='users.categorymodel')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('category', 'period')},
+            },
+        ),
+    ]
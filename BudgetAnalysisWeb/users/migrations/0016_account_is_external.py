@@ -0,0 +1,38 @@
+# Generated by Django 3.2.18 on 2026-10-18 06:56
+
+from django.db import migrations, models
+from django.db.models import Min, Q
+
+# Имя, по которому счет внешних операций искался до появления флага.
+EXTERNAL_ACCOUNT_NAME = 'Внешние операции'
+
+
+def mark_external_accounts(apps, schema_editor):
+    # Внешним считается счет с этим именем, который участвует в импортированных
+    # операциях; у пользователя с несколькими такими счетами - первый созданный.
+    Account = apps.get_model('users', 'Account')
+    alias = schema_editor.connection.alias
+    imported = Q(sent_transactions__import_hash__isnull=False) | Q(received_transactions__import_hash__isnull=False)
+    first = Account.objects.using(alias).filter(imported, name=EXTERNAL_ACCOUNT_NAME) \
+        .values('user_id').annotate(first=Min('pk')).values_list('first', flat=True)
+    Account.objects.using(alias).filter(pk__in=list(first)).update(is_external=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_categorybudget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='is_external',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_external_accounts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='account',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_external', True)), fields=('user',), name='account_one_external_per_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_account_is_external'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recurringtransaction',
+            name='failed_on',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
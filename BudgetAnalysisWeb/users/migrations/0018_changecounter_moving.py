@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_recurring_failed_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changecounter',
+            name='moving',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,15 +1,19 @@
-import os
+from collections import defaultdict
 
-from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.core.files import File
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 
 from BudgetAnalysisWeb.settings import AUTH_USER_MODEL
-from users.validators import positive_number_validator
+from users.defaults import default_categories_template
+from users.schedule import first_run
+from users.sharding import PRIMARY_DATABASE, is_purging, purge_user_data, shard_for
+from users.storage import icon_storage, default_icon
+from users.validators import positive_number_validator, schedule_validator
 
 
 class User(AbstractUser):
@@ -19,13 +23,16 @@ class User(AbstractUser):
     )
 
     email_verify = models.BooleanField(default=False)
+    # База с данными пользователя, если он перенесен командой rebalance_shards;
+    # пусто - шарда по хэшу id, см. users.sharding.
+    shard = models.CharField(max_length=50, blank=True, null=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
 
 class UserDataModel(models.Model):
-    user = models.OneToOneField(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.OneToOneField(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
     name = models.CharField(max_length=100, blank=True)
     surname = models.CharField(max_length=100, blank=True)
     patronymic = models.CharField(max_length=100, blank=True)
@@ -37,6 +44,27 @@ class UserDataModel(models.Model):
         return f"{self.name}: {self.user}"
 
 
+class VersionedQuerySet(models.QuerySet):
+    # Номер изменения и строка с ним фиксируются одной транзакцией. Иначе между
+    # ними успевает закоммитить другой писатель со следующим номером, клиент
+    # синхронизации (users.sync) сдвигает курсор за него и эту строку не получит.
+
+    def bulk_create(self, objs, *args, stamp_version=True, **kwargs):
+        # bulk_create не отправляет pre_save, поэтому номер изменения (см. users.sync)
+        # ставится здесь: один на пользователя для всей пачки.
+        if not stamp_version:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using, savepoint=False):
+            versions = {}
+            for obj in objs:
+                if obj.user_id not in versions:
+                    versions[obj.user_id] = next_change_version(obj.user_id, using)
+                obj.version = versions[obj.user_id]
+            return super().bulk_create(objs, *args, **kwargs)
+
+
 class CategoryModel(models.Model):
     EXPENSES = 'Расходы'
     INCOME = 'Доходы'
@@ -44,74 +72,335 @@ class CategoryModel(models.Model):
         (EXPENSES, 'Расходы'),
         (INCOME, 'Доходы'),
     )
-    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
     category_name = models.CharField(max_length=100, blank=True)
     key = models.CharField(max_length=100, choices=CATEGORY_TYPE_CHOICES, default=EXPENSES, blank=True)
-    icon = models.ImageField(upload_to='users/static/images/')
+    icon = models.ImageField(upload_to='users/static/images/', storage=icon_storage)
+    version = models.BigIntegerField(default=0, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version', 'id'], name='category_user_version_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Номер изменения (users.sync.stamp_version) ставится в pre_save: atomic
+        # фиксирует его вместе со строкой, см. VersionedQuerySet.
+        using = kwargs.get('using') or router.db_for_write(CategoryModel, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.category_name}: {self.user}"
 
 
 class Account(models.Model):
-    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
     name = models.CharField(max_length=50)
     balance = models.DecimalField(max_digits=10, decimal_places=2)
-    icon = models.ImageField(upload_to='users/static/images/')
+    icon = models.ImageField(upload_to='users/static/images/', storage=icon_storage)
+    version = models.BigIntegerField(default=0, editable=False)
+    # Счет-противоположная сторона импортированных и повторяющихся операций
+    # (users.statements.external_account): один на пользователя, без ограничения на минус.
+    is_external = models.BooleanField(default=False, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version', 'id'], name='account_user_version_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=models.Q(is_external=True),
+                                    name='account_one_external_per_user'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Номер изменения (users.sync.stamp_version) ставится в pre_save: atomic
+        # фиксирует его вместе со строкой, см. VersionedQuerySet.
+        using = kwargs.get('using') or router.db_for_write(Account, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name}"
 
 
 class Transaction(models.Model):
-    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
     from_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='sent_transactions')
     to_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='received_transactions')
     amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[positive_number_validator])
     date = models.DateField(default=timezone.now, editable=True)
     comment = models.CharField(max_length=200, null=True, blank=True)
+    category = models.ForeignKey(CategoryModel, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='transactions')
+    import_hash = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    version = models.BigIntegerField(default=0, editable=False)
+
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('user', 'import_hash')
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'], name='transaction_user_date_idx'),
+            models.Index(fields=['from_account', '-date', '-id'], name='transaction_from_date_idx'),
+            models.Index(fields=['to_account', '-date', '-id'], name='transaction_to_date_idx'),
+            # Покрывающий индекс для users.analytics: суммы по дням и категориям без чтения таблицы.
+            models.Index(fields=['user', 'date', 'category', 'amount'], name='transaction_analytics_idx'),
+            models.Index(fields=['user', 'version', 'id'], name='transaction_user_version_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Сводки и счетчики бюджетов (users.ledger) обновляются в post_save, номер
+        # изменения ставится в pre_save: atomic оставляет их в одной транзакции с записью операции.
+        using = kwargs.get('using') or router.db_for_write(Transaction, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.from_account} -> {self.to_account}: {self.amount}"
 
 
-def create_default_categories(sender, instance, created, **kwargs):
-    if created:
-        if CategoryModel.objects.filter(user=instance).count() == 0:
-            default_categories_expenses = [
-                {'name': 'Кафе и рестораны', 'icon': 'users/static/images/icon1.jpeg'},
-                {'name': 'Одежда и аксессуары', 'icon': 'users/static/images/icon2.jpeg'},
-                {'name': 'Красота и здоровье', 'icon': 'users/static/images/icon3.jpeg'},
-                {'name': 'Продукты', 'icon': 'users/static/images/icon4.jpeg'},
-                {'name': 'Все для дома', 'icon': 'users/static/images/icon5.jpeg'},
-                {'name': 'Транспорт', 'icon': 'users/static/images/icon1.jpeg'},
-                {'name': 'Развлечения', 'icon': 'users/static/images/icon2.jpeg'},
-                {'name': 'Обязательные платежи', 'icon': 'users/static/images/icon3.jpeg'},
-                {'name': 'Переводы', 'icon': 'users/static/images/icon4.jpeg'},
-                {'name': 'Другое', 'icon': 'users/static/images/icon5.jpeg'}
-            ]
-            default_categories_revenues = [
-                {'name': 'Зарплата', 'icon': 'users/static/images/icon1.jpeg'},
-                {'name': 'Стипендия', 'icon': 'users/static/images/icon2.jpeg'},
-                {'name': 'Социальные выплаты', 'icon': 'users/static/images/icon3.jpeg'},
-                {'name': 'Проценты по вкладу', 'icon': 'users/static/images/icon4.jpeg'},
-                {'name': 'Переводы', 'icon': 'users/static/images/icon5.jpeg'},
-                {'name': 'Другое', 'icon': 'users/static/images/icon5.jpeg'}
-            ]
-
-            for category_data in default_categories_expenses:
-                category = CategoryModel(user=instance, category_name=category_data['name'], key='Расходы')
-                icon_path = os.path.join(settings.MEDIA_ROOT, category_data['icon'])
-                with open(icon_path, 'rb') as f:
-                    category.icon.save(os.path.basename(icon_path), File(f), save=True)
-                category.save()
-
-            for category_data in default_categories_revenues:
-                category = CategoryModel(user=instance, category_name=category_data['name'], key='Доходы')
-                icon_path = os.path.join(settings.MEDIA_ROOT, category_data['icon'])
-                with open(icon_path, 'rb') as f:
-                    category.icon.save(os.path.basename(icon_path), File(f), save=True)
-                category.save()
+class RecurringTransaction(models.Model):
+    # Шаблон операции, которую команда run_recurring создает по правилу schedule
+    # (формат описан в users.schedule). next_run - дата следующей операции.
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    from_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='recurring_outgoing')
+    to_account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='recurring_incoming')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[positive_number_validator])
+    comment = models.CharField(max_length=200, null=True, blank=True)
+    category = models.ForeignKey(CategoryModel, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='recurring_transactions')
+    schedule = models.CharField(max_length=100, validators=[schedule_validator])
+    next_run = models.DateField(null=True, blank=True)
+    active = models.BooleanField(default=True)
+    # Дата запуска, в который операцию за next_run не удалось провести из-за
+    # нехватки средств. В этот день правило больше не обрабатывается, next_run
+    # не сдвигается: операция будет повторена при следующем запуске.
+    failed_on = models.DateField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_run', 'id'], name='recurring_due_idx', condition=Q(active=True)),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.next_run is None and self.active:
+            self.next_run = first_run(self.schedule, timezone.localdate())
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.from_account} -> {self.to_account}: {self.amount} ({self.schedule})"
+
+
+class AccountBalanceSnapshot(models.Model):
+    # Одна строка на счет и день, в который были операции. change - сумма
+    # операций за день, cumulative_change - сумма всех операций по этот день
+    # включительно. Баланс на дату получается из одной такой строки, см. users.ledger.balance_on.
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='balance_snapshots')
+    date = models.DateField()
+    change = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cumulative_change = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('account', 'date')
+
+    def __str__(self):
+        return f"{self.account} {self.date}: {self.cumulative_change}"
+
+
+class MonthlyCategoryTotal(models.Model):
+    # Сумма и количество операций пользователя по категории за месяц.
+    # month - первое число месяца, key повторяет CategoryModel.key.
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    month = models.DateField()
+    category = models.ForeignKey(CategoryModel, on_delete=models.CASCADE, related_name='monthly_totals')
+    key = models.CharField(max_length=100, choices=CategoryModel.CATEGORY_TYPE_CHOICES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'month', 'category')
+
+    def __str__(self):
+        return f"{self.category} {self.month:%Y-%m}: {self.total}"
+
+
+class CategoryBudget(models.Model):
+    # Лимит по категории на период: календарный месяц или неделю с понедельника.
+    # spent - сумма операций категории с датой внутри текущего периода, который
+    # начинается в period_start. Счетчик меняется в той же транзакции, что и
+    # операции (users.ledger), а в начале нового периода - командой rollover_budgets.
+    MONTH = 'month'
+    WEEK = 'week'
+    PERIOD_CHOICES = (
+        (MONTH, 'Месяц'),
+        (WEEK, 'Неделя'),
+    )
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    category = models.ForeignKey(CategoryModel, on_delete=models.CASCADE, related_name='budgets')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default=MONTH)
+    limit = models.DecimalField(max_digits=10, decimal_places=2, validators=[positive_number_validator])
+    period_start = models.DateField(editable=False)
+    spent = models.DecimalField(max_digits=14, decimal_places=2, default=0, editable=False)
+
+    class Meta:
+        unique_together = ('category', 'period')
+
+    @property
+    def remaining(self):
+        return self.limit - self.spent
+
+    @property
+    def exceeded(self):
+        return self.spent > self.limit
+
+    @property
+    def percent(self):
+        return min(int(self.spent * 100 / self.limit), 100) if self.limit else 100
+
+    def __str__(self):
+        return f"{self.category} ({self.get_period_display()}): {self.spent} / {self.limit}"
+
+
+class ChangeCounter(models.Model):
+    # Счетчик изменений данных пользователя. Каждая запись счета, категории или
+    # операции получает следующий номер в поле version, см. users.sync.
+    # reset_version - номер, до которого курсоры синхронизации недействительны
+    # (после переноса в другую шарду первичные ключи меняются).
+    user = models.OneToOneField(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    version = models.BigIntegerField(default=0)
+    reset_version = models.BigIntegerField(default=0)
+    # Пользователь переносится в другую шарду (rebalance_shards): запись его данных запрещена.
+    moving = models.BooleanField(default=False, editable=False)
+
+    def __str__(self):
+        return f"{self.user}: {self.version}"
+
+
+class DeletedRecord(models.Model):
+    # Удаленные строки для синхронизации изменений (?since= в API).
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False)
+    model_name = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'model_name', 'version'], name='deleted_user_version_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} {self.object_id}: {self.version}"
+
+
+class UserMovingError(ValidationError):
+
+    def __init__(self):
+        super().__init__('Данные переносятся в другую базу, повторите через несколько минут', code='user_moving')
+
+
+def next_change_version(user_id, using):
+    # UPDATE блокирует строку счетчика до конца транзакции записи, поэтому перенос,
+    # который ставит moving, ждет начатые записи, а следующие за ним получают ошибку.
+    counters = ChangeCounter.objects.using(using).filter(user_id=user_id)
+    if not counters.filter(moving=False).update(version=F('version') + 1):
+        ChangeCounter.objects.using(using).get_or_create(user_id=user_id)
+        if not counters.filter(moving=False).update(version=F('version') + 1):
+            raise UserMovingError()
+    return counters.values_list('version', flat=True).get()
+
+
+def ensure_user_writable(user_id, using):
+    """То же для данных без номера изменения (профиль, бюджеты, повторяющиеся операции)."""
+    counters = ChangeCounter.objects.using(using).filter(user_id=user_id)
+    if not counters.filter(moving=False).update(version=F('version')) and counters.exists():
+        raise UserMovingError()
+
+
+class OutboxEmail(models.Model):
+    VERIFY = 'verify'
+    KIND_CHOICES = (
+        (VERIFY, 'Подтверждение почты'),
+    )
+    PENDING = 'pending'
+    SENT = 'sent'
+    COALESCED = 'coalesced'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'В очереди'),
+        (SENT, 'Отправлено'),
+        (COALESCED, 'Объединено с другим письмом'),
+        (FAILED, 'Ошибка'),
+    )
+    user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    domain = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    lease = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+            models.Index(fields=['user', 'kind', 'created_at'], name='outbox_user_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} -> {self.user}: {self.status}"
+
+
+def build_default_categories(user_ids):
+    template = default_categories_template()
+    icons = {category['icon']: default_icon(category['icon']) for category in template}
+    return [
+        CategoryModel(user_id=user_id, category_name=category['name'], key=category['key'],
+                      icon=icons[category['icon']])
+        for user_id in user_ids
+        for category in template
+    ]
+
+
+def provision_default_categories(users):
+    # Один INSERT на шарду: пользователи разных шард не смешиваются в одном bulk_create.
+    by_shard = defaultdict(list)
+    for user in users:
+        by_shard[shard_for(user)].append(user.pk)
+    created = []
+    for shard, user_ids in by_shard.items():
+        # Категории нового пользователя появляются раньше любой синхронизации, номер изменения им не нужен.
+        created += CategoryModel.objects.using(shard).bulk_create(build_default_categories(user_ids),
+                                                                  stamp_version=False)
+    return created
+
+
+def create_default_categories(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        provision_default_categories([instance])
+
+
+def check_user_writable(sender, instance, raw=False, using=None, **kwargs):
+    if not raw and not is_purging(instance.user_id):
+        ensure_user_writable(instance.user_id, using)
+
+
+def delete_sharded_data(sender, instance, **kwargs):
+    # Каскадное удаление видит только основную базу, данные в шарде удаляются отдельно.
+    # В основной базе каскад оставляет записи синхронизации: удаление каждой строки пишет
+    # DeletedRecord и заново создает ChangeCounter. purge_user_data удаляет их последними.
+    for alias in dict.fromkeys([shard_for(instance), PRIMARY_DATABASE]):
+        purge_user_data(instance.pk, alias)
 
 
 post_save.connect(create_default_categories, sender=AUTH_USER_MODEL)
+post_delete.connect(delete_sharded_data, sender=AUTH_USER_MODEL)
+for model in (UserDataModel, CategoryBudget, RecurringTransaction):
+    pre_save.connect(check_user_writable, sender=model)
+    pre_delete.connect(check_user_writable, sender=model)
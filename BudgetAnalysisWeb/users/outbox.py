@@ -0,0 +1,107 @@
+import datetime
+import uuid
+
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.mail import get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from users.models import OutboxEmail
+from users.utils import verify_email_message
+
+COALESCE_WINDOW = datetime.timedelta(minutes=10)
+LEASE_TIME = datetime.timedelta(minutes=5)
+RETRY_BASE_DELAY = datetime.timedelta(seconds=30)
+MAX_ATTEMPTS = 6
+
+MESSAGE_BUILDERS = {
+    OutboxEmail.VERIFY: verify_email_message,
+}
+
+
+def enqueue(user, kind, domain):
+    """
+    Ставит письмо в очередь. Повторные письма того же вида пользователю
+    не создаются, пока предыдущее ждет отправки или отправлено недавно.
+    """
+    recent = OutboxEmail.objects.filter(user=user, kind=kind).filter(
+        Q(status=OutboxEmail.PENDING) | Q(created_at__gte=timezone.now() - COALESCE_WINDOW)
+    ).exclude(status=OutboxEmail.FAILED)
+    if recent.exists():
+        return None
+    return OutboxEmail.objects.create(user=user, kind=kind, domain=domain)
+
+
+def send_email_for_verify(request, user):
+    # Само письмо отправит обработчик очереди (manage.py run_outbox), а не этот запрос.
+    return enqueue(user, OutboxEmail.VERIFY, get_current_site(request).domain)
+
+
+def claim_batch(batch_size):
+    # Аренда вместо блокировки строк: письма, взятые упавшим обработчиком,
+    # снова станут доступны после LEASE_TIME.
+    now = timezone.now()
+    lease = uuid.uuid4().hex
+    due = OutboxEmail.objects.filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    due.filter(id__in=ids).update(lease=lease, next_attempt_at=now + LEASE_TIME)
+    return list(OutboxEmail.objects.filter(lease=lease, status=OutboxEmail.PENDING)
+                .select_related('user').order_by('id'))
+
+
+def _fail(email, error, stats):
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboxEmail.FAILED
+    else:
+        email.next_attempt_at = timezone.now() + RETRY_BASE_DELAY * 2 ** (email.attempts - 1)
+    stats[email.status] += 1
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def deliver_batch(batch_size=100):
+    """Отправляет одну пачку писем через одно SMTP-соединение. Возвращает {статус: количество}."""
+    emails = claim_batch(batch_size)
+    stats = {OutboxEmail.SENT: 0, OutboxEmail.COALESCED: 0, OutboxEmail.PENDING: 0, OutboxEmail.FAILED: 0}
+    if not emails:
+        return stats
+
+    seen = set()
+    coalesced = []
+    to_send = []
+    for email in emails:
+        key = (email.user_id, email.kind)
+        if key in seen:
+            coalesced.append(email.pk)
+        else:
+            seen.add(key)
+            to_send.append(email)
+    if coalesced:
+        OutboxEmail.objects.filter(pk__in=coalesced).update(status=OutboxEmail.COALESCED)
+        stats[OutboxEmail.COALESCED] = len(coalesced)
+
+    sent = []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for email in to_send:
+            _fail(email, e, stats)
+        return stats
+    try:
+        for email in to_send:
+            try:
+                message = MESSAGE_BUILDERS[email.kind](email.user, email.domain)
+                message.connection = connection
+                message.send()
+            except Exception as e:
+                _fail(email, e, stats)
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.filter(pk__in=sent).update(status=OutboxEmail.SENT, sent_at=timezone.now())
+    stats[OutboxEmail.SENT] = len(sent)
+    return stats
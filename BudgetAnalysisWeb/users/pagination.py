@@ -0,0 +1,56 @@
+import base64
+import datetime
+
+from django.db.models import Q
+
+# Наибольший id, который помещается в целое со знаком SQLite и PostgreSQL (bigint).
+MAX_ID = 2 ** 63 - 1
+
+
+def keyset_filter(queryset, date, pk, descending=False):
+    # Строки строго после (date, pk) в порядке сортировки по (date, id).
+    if descending:
+        return queryset.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+    return queryset.filter(Q(date__gt=date) | Q(date=date, pk__gt=pk))
+
+
+def keyset_order(queryset, descending=False):
+    return queryset.order_by('-date', '-pk') if descending else queryset.order_by('date', 'pk')
+
+
+def keyset_iterate(queryset, batch_size=2000, descending=False):
+    """Обходит queryset блоками по (date, id) без OFFSET и без кэша всего результата."""
+    queryset = keyset_order(queryset, descending)
+    batch = list(queryset[:batch_size])
+    while batch:
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+        batch = list(keyset_filter(queryset, last.date, last.pk, descending)[:batch_size])
+
+
+def encode_cursor(record):
+    return base64.urlsafe_b64encode(f'{record.date.isoformat()}|{record.pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date, pk = value.split('|')
+        date, pk = datetime.date.fromisoformat(date), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    # id вне диапазона столбца база не примет (OverflowError в SQLite): такой курсор тоже неверный.
+    return (date, pk) if 0 < pk <= MAX_ID else None
+
+
+def keyset_page(queryset, cursor=None, size=50, descending=True):
+    """Возвращает (строки, курсор следующей страницы или None)."""
+    queryset = keyset_order(queryset, descending)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        queryset = keyset_filter(queryset, *position, descending=descending)
+    rows = list(queryset[:size + 1])
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    return rows[:size], next_cursor
@@ -0,0 +1,146 @@
+import hashlib
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import router, transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from users.db import retry_on_locked
+from users.models import Account, RecurringTransaction, Transaction
+from users.schedule import next_run_after
+from users.sharding import use_database, user_shards
+from users.signals import transactions_bulk_created
+from users.transfers import lock_accounts
+
+RUN_BATCH_SIZE = 1000
+BALANCE_UPDATE_CHUNK = 400
+
+
+class RecurringResult(namedtuple('RecurringResult', ['rules', 'created', 'duplicates', 'skipped'])):
+
+    def __add__(self, other):
+        return RecurringResult(*(a + b for a, b in zip(self, other)))
+
+
+EMPTY_RESULT = RecurringResult(0, 0, 0, 0)
+
+
+def occurrence_hash(rule_id, date):
+    # Операция по правилу за дату создается не более одного раза: повторный
+    # запуск после сбоя наткнется на unique_together ('user', 'import_hash').
+    return hashlib.blake2b(f'recurring|{rule_id}|{date.isoformat()}'.encode(), digest_size=16).hexdigest()
+
+
+def occurrences(rule, today):
+    """Даты пропущенных и сегодняшних операций по правилу и следующая дата после today."""
+    dates = []
+    date = rule.next_run
+    while date is not None and date <= today:
+        dates.append(date)
+        date = next_run_after(rule.schedule, date)
+    return dates, date
+
+
+def due_rules(today):
+    return RecurringTransaction.objects.filter(active=True, next_run__lte=today).exclude(failed_on=today) \
+        .order_by('next_run', 'id')
+
+
+def _update_balances(deltas):
+    # Один UPDATE с CASE на блок счетов вместо UPDATE на каждый счет.
+    items = sorted((pk, delta) for pk, delta in deltas.items() if delta)
+    for start in range(0, len(items), BALANCE_UPDATE_CHUNK):
+        chunk = items[start:start + BALANCE_UPDATE_CHUNK]
+        change = Case(*(When(pk=pk, then=Value(delta)) for pk, delta in chunk),
+                      output_field=DecimalField(max_digits=10, decimal_places=2))
+        Account.objects.filter(pk__in=[pk for pk, _ in chunk]).update(balance=F('balance') + change)
+
+
+@retry_on_locked(model=Transaction)
+def run_batch(today, batch_size=RUN_BATCH_SIZE):
+    """
+    Создает операции по одной пачке правил со сроком не позже today и сдвигает
+    их next_run. Все изменения пачки - в одной транзакции. Возвращает RecurringResult.
+    """
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        rules = list(due_rules(today)[:batch_size])
+        if not rules:
+            return EMPTY_RESULT
+        planned = [(rule, *occurrences(rule, today)) for rule in rules]
+        account_ids = {rule.from_account_id for rule in rules} | {rule.to_account_id for rule in rules}
+        lock_accounts(account_ids)
+        balances = {}
+        unlimited = set()
+        for pk, balance, is_external in Account.objects.filter(pk__in=account_ids) \
+                .values_list('pk', 'balance', 'is_external'):
+            balances[pk] = balance
+            if is_external:
+                unlimited.add(pk)
+        hashes = [occurrence_hash(rule.pk, date) for rule, dates, _ in planned for date in dates]
+        existing = set(Transaction.objects.filter(user_id__in={rule.user_id for rule in rules},
+                                                  import_hash__in=hashes).values_list('import_hash', flat=True))
+
+        records = []
+        # Правило -> первая дата, операцию за которую провести не удалось.
+        failed = {}
+        deltas = defaultdict(Decimal)
+        duplicates = skipped = 0
+        # Операции пачки проводятся по порядку дат: зарплата 31-го успевает
+        # пополнить счет до списания аренды 1-го числа.
+        for date, _, rule in sorted((date, index, rule) for index, (rule, dates, _) in enumerate(planned)
+                                    for date in dates):
+            import_hash = occurrence_hash(rule.pk, date)
+            if import_hash in existing:
+                duplicates += 1
+                continue
+            # Как и обычный перевод, операция не уводит счет в минус. Пропущенная
+            # операция и следующие за ней по тому же правилу ждут следующего запуска.
+            if rule.pk in failed or (rule.from_account_id not in unlimited
+                                     and balances[rule.from_account_id] < rule.amount):
+                failed.setdefault(rule.pk, date)
+                skipped += 1
+                continue
+            balances[rule.from_account_id] -= rule.amount
+            balances[rule.to_account_id] += rule.amount
+            deltas[rule.from_account_id] -= rule.amount
+            deltas[rule.to_account_id] += rule.amount
+            records.append(Transaction(
+                user_id=rule.user_id,
+                from_account_id=rule.from_account_id,
+                to_account_id=rule.to_account_id,
+                amount=rule.amount,
+                date=date,
+                comment=rule.comment,
+                category_id=rule.category_id,
+                import_hash=import_hash,
+            ))
+
+        Transaction.objects.bulk_create(records)
+        _update_balances(deltas)
+        advance = defaultdict(list)
+        for rule, _, next_run in planned:
+            if rule.pk in failed:
+                advance[(failed[rule.pk], today)].append(rule.pk)
+            else:
+                advance[(next_run, None)].append(rule.pk)
+        for (next_run, failed_on), rule_ids in advance.items():
+            # Правило без будущих дат отключается.
+            RecurringTransaction.objects.filter(pk__in=rule_ids) \
+                .update(next_run=next_run, active=next_run is not None, failed_on=failed_on)
+        transactions_bulk_created.send(sender=Transaction, records=records)
+    return RecurringResult(len(rules), len(records), duplicates, skipped)
+
+
+def run_recurring(today=None, batch_size=RUN_BATCH_SIZE):
+    """Обрабатывает все правила со сроком не позже today во всех шардах."""
+    today = today or timezone.localdate()
+    result = EMPTY_RESULT
+    for alias in user_shards():
+        with use_database(alias):
+            while True:
+                batch = run_batch(today, batch_size)
+                result += batch
+                if batch.rules < batch_size:
+                    break
+    return result
@@ -0,0 +1,95 @@
+import calendar
+import datetime
+from collections import namedtuple
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+
+# Правило повторения - три поля cron без времени: "день_месяца месяц день_недели".
+# Поля: *, число, диапазон 1-5, список 1,15, шаг */2 или 1-10/3. В дне месяца
+# L - последний день месяца; день недели 0-7, 0 и 7 - воскресенье.
+# Как в cron, если заданы и день месяца, и день недели, подходит любой из них.
+#   "1 * *"     - первого числа каждого месяца
+#   "L * *"     - в последний день месяца
+#   "* * 1"     - по понедельникам
+#   "10,25 * *" - 10 и 25 числа
+#   "15 1,7 *"  - 15 января и 15 июля
+LAST_DAY = 0
+# За восемь лет встретится любая дата, включая 29 февраля.
+SEARCH_LIMIT = datetime.timedelta(days=366 * 8)
+
+Schedule = namedtuple('Schedule', ['days', 'months', 'weekdays', 'any_day', 'any_weekday'])
+
+
+def _parse_field(value, low, high, allow_last=False):
+    values = set()
+    for part in value.split(','):
+        if allow_last and part == 'L':
+            values.add(LAST_DAY)
+            continue
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, _, end = part.partition('-')
+            start, end = int(start), int(end)
+        else:
+            start = end = int(part)
+            if step:
+                end = high
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(part)
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+@lru_cache(maxsize=1024)
+def parse_schedule(expression):
+    fields = expression.split()
+    if len(fields) != 3:
+        raise ValidationError('Правило должно состоять из трех полей: день месяца, месяц, день недели')
+    day, month, weekday = fields
+    try:
+        weekdays = frozenset(value % 7 for value in _parse_field(weekday, 0, 7))
+        return Schedule(
+            days=_parse_field(day, 1, 31, allow_last=True),
+            months=_parse_field(month, 1, 12),
+            weekdays=weekdays,
+            any_day=day == '*',
+            any_weekday=weekday == '*',
+        )
+    except ValueError:
+        raise ValidationError(f'Неверное правило повторения: {expression}')
+
+
+def _matches(schedule, date):
+    day_matches = date.day in schedule.days or (
+        LAST_DAY in schedule.days and date.day == calendar.monthrange(date.year, date.month)[1]
+    )
+    weekday_matches = (date.weekday() + 1) % 7 in schedule.weekdays
+    if schedule.any_day or schedule.any_weekday:
+        return day_matches and weekday_matches
+    return day_matches or weekday_matches
+
+
+@lru_cache(maxsize=65536)
+def next_run_after(expression, date):
+    """Первая дата строго после date, подходящая под правило, или None."""
+    schedule = parse_schedule(expression)
+    limit = date + SEARCH_LIMIT
+    date += datetime.timedelta(days=1)
+    while date <= limit:
+        if date.month not in schedule.months:
+            # Пропускаем месяц целиком.
+            date = (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            continue
+        if _matches(schedule, date):
+            return date
+        date += datetime.timedelta(days=1)
+    return None
+
+
+def first_run(expression, date):
+    """Первая подходящая дата, начиная с date включительно."""
+    return next_run_after(expression, date - datetime.timedelta(days=1))
@@ -0,0 +1,196 @@
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_migrate
+
+from users.models import Transaction
+
+# Полнотекстовый индекс SQLite FTS5 по комментариям операций и названиям их категорий.
+# rowid строки индекса - id операции, owner - 'u<id пользователя>': условие на владельца
+# проверяется внутри индекса, а не отдельным проходом по найденным строкам.
+# Индекс поддерживают триггеры, поэтому в него попадают и bulk_create, и UPDATE без save().
+# Префиксы до 8 символов хранятся в индексе (prefix): без этого запрос "такс"* собирает
+# в памяти список всех строк со словами на "такс" у всех пользователей.
+SEARCH_TABLE = 'users_transaction_search'
+SEARCH_LIMIT = 50
+MAX_SEARCH_TERMS = 8
+# Ранжируются только столько последних совпадений: FTS5 отдает их в порядке rowid
+# без сортировки, и время не зависит от размера журнала.
+SEARCH_RANK_WINDOW = 1000
+# Название категории общее у многих операций, поэтому совпадение в нем весит меньше.
+COMMENT_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.25
+
+
+def _folded(column):
+    # remove_diacritics в unicode61 не трогает кириллицу: ё приводится к е до индексации.
+    return f"replace(replace(coalesce({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+_INDEXED_ROW = f"""
+    VALUES (new.id, 'u' || new.user_id, {_folded('new.comment')},
+            {_folded('(SELECT category_name FROM users_categorymodel WHERE id = new.category_id)')});
+"""
+SEARCH_TRIGGERS = {
+    'users_transaction_search_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_insert AFTER INSERT ON users_transaction BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, owner, comment, category) {_INDEXED_ROW}
+        END
+    """,
+    # Запись версии (users.sync) и баланса не трогает индекс.
+    'users_transaction_search_update': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_update
+        AFTER UPDATE OF user_id, comment, category_id ON users_transaction BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+            INSERT INTO {SEARCH_TABLE} (rowid, owner, comment, category) {_INDEXED_ROW}
+        END
+    """,
+    'users_transaction_search_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_delete AFTER DELETE ON users_transaction BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        END
+    """,
+    'users_transaction_search_category': f"""
+        CREATE TRIGGER IF NOT EXISTS users_transaction_search_category
+        AFTER UPDATE OF category_name ON users_categorymodel BEGIN
+            UPDATE {SEARCH_TABLE} SET category = {_folded('new.category_name')}
+            WHERE rowid IN (SELECT id FROM users_transaction WHERE category_id = new.id);
+        END
+    """,
+}
+CREATE_TABLE_SQL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        owner, comment, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4 5 6 7 8'
+    )
+"""
+POPULATE_SQL = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, owner, comment, category)
+    SELECT t.id, 'u' || t.user_id, {_folded('t.comment')}, {_folded('c.category_name')}
+    FROM users_transaction t LEFT JOIN users_categorymodel c ON c.id = t.category_id
+"""
+
+
+def search_supported(using):
+    return connections[using].vendor == 'sqlite'
+
+
+def _words(text):
+    return re.findall(r'\w+', text.lower().replace('ё', 'е'))
+
+
+def search_terms(text):
+    return _words(text)[:MAX_SEARCH_TERMS]
+
+
+def match_expression(user_id, terms):
+    """
+    Запрос FTS5: строки пользователя, где каждое слово - начало слова в комментарии
+    или в названии категории. Слова берутся в кавычки, поэтому синтаксис FTS5 в них не действует.
+    """
+    phrases = ' AND '.join(f'"{term}"*' for term in terms)
+    return f'owner : "u{user_id}" AND {{comment category}} : ({phrases})'
+
+
+def filter_matching(queryset, user, text):
+    """Операции queryset, подходящие под поисковую строку; порядок queryset сохраняется."""
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+    if not search_supported(queryset.db):
+        for term in terms:
+            queryset = queryset.filter(Q(comment__icontains=term) | Q(category__category_name__icontains=term))
+        return queryset
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', (match_expression(user.pk, terms),)
+    ))
+
+
+def rank_score(terms, comment, category):
+    """
+    Чем больше слов запроса совпадает со словами комментария и категории, тем выше;
+    совпадение целого слова весит вдвое больше совпадения начала слова, длинный текст - меньше.
+    """
+    score = 0.0
+    for text, weight in ((comment, COMMENT_WEIGHT), (category, CATEGORY_WEIGHT)):
+        words = _words(text)
+        if words:
+            matches = sum(1.0 if word == term else 0.5 for term in terms for word in words if word.startswith(term))
+            score += weight * matches / len(words) ** 0.5
+    return score
+
+
+def search_transactions(user, text, limit=SEARCH_LIMIT):
+    """
+    Операции пользователя по поисковой строке, лучшие совпадения первыми
+    среди SEARCH_RANK_WINDOW последних совпадений.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    queryset = Transaction.objects.filter(user=user).select_related('from_account', 'to_account', 'category')
+    using = queryset.db
+    if not search_supported(using):
+        return list(filter_matching(queryset, user, text).order_by('-date', '-id')[:limit])
+    with connections[using].cursor() as cursor:
+        # bm25() не подходит: для IDF он проходит все строки индекса с каждым словом
+        # запроса, у частого слова в большом журнале это десятки миллисекунд.
+        cursor.execute(
+            f'SELECT rowid, comment, category FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY rowid DESC LIMIT %s',
+            (match_expression(user.pk, terms), SEARCH_RANK_WINDOW),
+        )
+        candidates = cursor.fetchall()
+    # Комментарии и категории в журнале часто повторяются: оценка считается один раз на пару.
+    scores = {}
+    for _, comment, category in candidates:
+        if (comment, category) not in scores:
+            scores[comment, category] = rank_score(terms, comment, category)
+    ranked = sorted(candidates, key=lambda row: (-scores[row[1], row[2]], -row[0]))
+    ids = [row[0] for row in ranked[:limit]]
+    records = queryset.in_bulk(ids)
+    # Индекс мог отстать от таблицы только при ручной правке базы: такие id пропускаются.
+    return [records[pk] for pk in ids if pk in records]
+
+
+def install_search_index(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE_SQL)
+        for sql in SEARCH_TRIGGERS.values():
+            cursor.execute(sql)
+
+
+def rebuild_search_index(using=None):
+    """Заново заполняет индекс по таблице операций. Возвращает число строк индекса."""
+    using = using or router.db_for_write(Transaction)
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        install_search_index(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(POPULATE_SQL)
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+            return cursor.fetchone()[0]
+
+
+def ensure_search_index(sender, app_config=None, using='default', **kwargs):
+    # Изменение модели Transaction в SQLite пересоздает таблицу (_remake_table),
+    # и ее триггеры удаляются вместе со старой таблицей. После migrate недостающие
+    # триггеры создаются заново, а индекс перестраивается.
+    if app_config is None or app_config.label != 'users' or not search_supported(using):
+        return
+    if not router.allow_migrate_model(using, Transaction):
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name = %s OR type = 'trigger'", (SEARCH_TABLE,))
+        existing = {name for _, name in cursor.fetchall()}
+    if SEARCH_TABLE in existing and not set(SEARCH_TRIGGERS) <= existing:
+        rebuild_search_index(using)
+
+
+post_migrate.connect(ensure_search_index, dispatch_uid='users.search.ensure_search_index')
@@ -0,0 +1,164 @@
+import contextlib
+import hashlib
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Данные пользователя (профиль, категории, счета, операции и их сводки) лежат
+# целиком в одной базе-шарде; пользователи, сессии и остальные таблицы - в основной.
+SHARDED_MODELS = {'userdatamodel', 'categorymodel', 'account', 'transaction', 'recurringtransaction',
+                  'accountbalancesnapshot', 'monthlycategorytotal', 'categorybudget', 'changecounter',
+                  'deletedrecord'}
+PRIMARY_DATABASE = DEFAULT_DB_ALIAS
+SHARD_CACHE_TIMEOUT = 3600
+
+_current_database = ContextVar('current_database', default=None)
+_purged_user = ContextVar('purged_user', default=None)
+
+
+def user_shards():
+    return list(getattr(settings, 'USER_SHARDS', [PRIMARY_DATABASE]))
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'users' and model._meta.model_name in SHARDED_MODELS
+
+
+def hashed_shard(user_id, shards=None):
+    shards = shards or user_shards()
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return shards[int.from_bytes(digest, 'big') % len(shards)]
+
+
+def _shard_cache_key(user_id):
+    return f'users:shard:{user_id}'
+
+
+def shard_for(user):
+    """
+    Шарда пользователя: закрепленная в User.shard (после переноса командой
+    rebalance_shards) или вычисленная по хэшу id. Принимает пользователя или id.
+    """
+    shards = user_shards()
+    if len(shards) == 1:
+        return shards[0]
+    if hasattr(user, 'shard'):
+        return user.shard or hashed_shard(user.pk, shards)
+    key = _shard_cache_key(user)
+    shard = cache.get(key)
+    if shard is None:
+        from django.contrib.auth import get_user_model
+        pinned = get_user_model().objects.using(PRIMARY_DATABASE).filter(pk=user) \
+            .values_list('shard', flat=True).first()
+        shard = pinned or hashed_shard(user, shards)
+        cache.set(key, shard, SHARD_CACHE_TIMEOUT)
+    return shard
+
+
+def forget_shard(user_id):
+    cache.delete(_shard_cache_key(user_id))
+
+
+def current_database():
+    return _current_database.get()
+
+
+@contextlib.contextmanager
+def use_database(alias):
+    # Запросы к данным пользователей без явного using() внутри блока идут в alias.
+    token = _current_database.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_database.reset(token)
+
+
+def use_user_shard(user):
+    return use_database(shard_for(user))
+
+
+@contextlib.contextmanager
+def _purging(user_id):
+    token = _purged_user.set(user_id)
+    try:
+        yield
+    finally:
+        _purged_user.reset(token)
+
+
+def is_purging(user_id):
+    # Удаляемые purge_user_data строки не записываются в DeletedRecord и не проверяют перенос.
+    return _purged_user.get() == user_id
+
+
+def purge_user_data(user_id, alias):
+    """Удаляет данные пользователя из базы alias: после переноса или удаления пользователя."""
+    from users.models import Account, AccountBalanceSnapshot, CategoryBudget, CategoryModel, ChangeCounter, \
+        DeletedRecord, MonthlyCategoryTotal, RecurringTransaction, Transaction, UserDataModel
+    with use_database(alias), _purging(user_id):
+        # Сначала сводки и бюджеты, чтобы удаление операций не пересчитывало их построчно.
+        MonthlyCategoryTotal.objects.using(alias).filter(user_id=user_id).delete()
+        CategoryBudget.objects.using(alias).filter(user_id=user_id).delete()
+        AccountBalanceSnapshot.objects.using(alias).filter(account__user_id=user_id).delete()
+        for model in (RecurringTransaction, Transaction, Account, CategoryModel, UserDataModel, DeletedRecord,
+                      ChangeCounter):
+            model.objects.using(alias).filter(user_id=user_id).delete()
+
+
+def all_databases():
+    return list(dict.fromkeys([PRIMARY_DATABASE] + user_shards()))
+
+
+class UserShardRouter:
+    """
+    Ставит модели из SHARDED_MODELS в шарду пользователя. Шарда берется из
+    объекта-подсказки (его базы или user_id), иначе из use_database(): для
+    запросов это делает UserShardMiddleware, для команд - сам код команды.
+    """
+
+    def _shard_for_instance(self, instance):
+        if instance is None:
+            return None
+        if instance._state.db:
+            return instance._state.db
+        user = instance._state.fields_cache.get('user')
+        if user is not None:
+            return shard_for(user)
+        user_id = getattr(instance, 'user_id', None)
+        return shard_for(user_id) if user_id is not None else None
+
+    def _route(self, model, **hints):
+        if not is_sharded(model):
+            return PRIMARY_DATABASE
+        instance = hints.get('instance')
+        if instance is not None and instance._meta.label == settings.AUTH_USER_MODEL:
+            # user.account_set и другие обратные связи от пользователя
+            return shard_for(instance)
+        if instance is not None and is_sharded(type(instance)):
+            shard = self._shard_for_instance(instance)
+            if shard:
+                return shard
+        return current_database() or PRIMARY_DATABASE
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Внешние ключи на пользователя ведут из шарды в основную базу.
+        if obj1._meta.app_label == obj2._meta.app_label == 'users':
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == PRIMARY_DATABASE:
+            # В основной базе есть и таблицы шард: пустые, если она не шарда,
+            # чтобы каскадное удаление пользователя и админка не падали.
+            return None
+        # Остальные базы - шарды, в том числе еще не добавленные в USER_SHARDS:
+        # их можно подготовить командой migrate --database до переключения.
+        return app_label == 'users' and model_name in SHARDED_MODELS
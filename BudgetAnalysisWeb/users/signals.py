@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# bulk_create не отправляет post_save, поэтому код, создающий операции
+# пачкой, отправляет этот сигнал с созданными записями (records).
+transactions_bulk_created = Signal()
@@ -0,0 +1,228 @@
+import csv
+import datetime
+import hashlib
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import F
+
+from users.db import retry_on_locked
+from users.models import Account, CategoryModel, Transaction
+from users.signals import transactions_bulk_created
+
+EXTERNAL_ACCOUNT_NAME = 'Внешние операции'
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y')
+OFX_READ_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 100
+CENT = Decimal('0.01')
+
+StatementRow = namedtuple('StatementRow', ['date', 'amount', 'description', 'category', 'reference'])
+
+
+class ImportResult(namedtuple('ImportResult', ['created', 'duplicates', 'invalid', 'elapsed'])):
+
+    @property
+    def rate(self):
+        processed = self.created + self.duplicates + self.invalid
+        return processed / self.elapsed if self.elapsed else 0
+
+
+def _required(value, name):
+    # У короткой строки CSV DictReader подставляет None вместо недостающих колонок.
+    value = (value or '').strip()
+    if not value:
+        raise ValidationError(f'Не заполнено поле {name}')
+    return value
+
+
+def _parse_date(value):
+    value = _required(value, 'date')
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValidationError(f'Неизвестный формат даты: {value}')
+
+
+def _parse_amount(value):
+    value = _required(value, 'amount')
+    try:
+        amount = Decimal(value.replace('\xa0', '').replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValidationError(f'Неверная сумма: {value}')
+    # Decimal принимает NaN и Infinity, дальше с ними не работает ни одно сравнение.
+    if not amount.is_finite():
+        raise ValidationError(f'Неверная сумма: {value}')
+    return amount
+
+
+def parse_csv(lines):
+    # Колонки: date, amount, description и необязательная category.
+    # Отрицательная сумма - списание со счета, положительная - зачисление.
+    for row in csv.DictReader(lines):
+        yield StatementRow(
+            date=row.get('date', ''),
+            amount=row.get('amount', ''),
+            description=(row.get('description') or '').strip(),
+            category=(row.get('category') or '').strip(),
+            reference='',
+        )
+
+
+def _ofx_tokens(stream):
+    # OFX бывает как SGML без закрывающих тегов, так и XML в одну строку,
+    # поэтому файл читается блоками и режется по '<', а не по строкам.
+    tail = ''
+    while True:
+        chunk = stream.read(OFX_READ_SIZE)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8', errors='replace')
+        if not chunk:
+            break
+        parts = (tail + chunk).split('<')
+        tail = parts.pop()
+        for part in parts:
+            if part:
+                tag, _, value = part.partition('>')
+                yield tag.strip().upper(), value.strip()
+    if tail:
+        tag, _, value = tail.partition('>')
+        yield tag.strip().upper(), value.strip()
+
+
+def parse_ofx(stream):
+    record = None
+    for tag, value in _ofx_tokens(stream):
+        if tag == 'STMTTRN':
+            record = {}
+        elif tag == '/STMTTRN' and record is not None:
+            yield StatementRow(
+                date=record.get('DTPOSTED', '')[:8],
+                amount=record.get('TRNAMT', ''),
+                description=record.get('MEMO') or record.get('NAME', ''),
+                category='',
+                reference=record.get('FITID', ''),
+            )
+            record = None
+        elif record is not None and not tag.startswith('/'):
+            record[tag] = value
+
+
+def _ofx_date(value):
+    if value and len(value) == 8 and value.isdigit():
+        return f'{value[:4]}-{value[4:6]}-{value[6:]}'
+    return value
+
+
+def parse_statement(stream, fmt):
+    return parse_csv(stream) if fmt == 'csv' else parse_ofx(stream)
+
+
+def detect_format(filename):
+    return 'ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def clean_rows(rows, account_id):
+    """Проверяет строки и добавляет к ним ключ для поиска дубликатов. Выдает (строка, ошибка)."""
+    seen_date = None
+    occurrences = defaultdict(int)
+    for number, row in enumerate(rows, start=1):
+        try:
+            date = _parse_date(_ofx_date(row.date))
+            amount = _parse_amount(row.amount)
+            # Те же проверки, что у Transaction.amount (разрядность, копейки, знак): сумма
+            # не округляется при сохранении и не роняет bulk_create посреди импорта.
+            # normalize убирает незначащие нули: 100.000 - это 100, а не три знака после запятой.
+            Transaction._meta.get_field('amount').clean(abs(amount).normalize(), None)
+        except ValidationError as e:
+            yield None, f'Строка {number}: {e.messages[0]}'
+            continue
+        # Одинаковые операции в один день различаются порядковым номером.
+        # Выписки упорядочены по дате, поэтому счетчики нужны только за текущий день.
+        if date != seen_date:
+            seen_date = date
+            occurrences.clear()
+        identity = row.reference or f'{amount}|{row.description}'
+        occurrences[identity] += 1
+        key = f'{account_id}|{date.isoformat()}|{identity}|{occurrences[identity]}'
+        import_hash = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        yield row._replace(date=date, amount=amount.quantize(CENT), reference=import_hash), None
+
+
+def external_account(user):
+    account, _ = Account.objects.get_or_create(user=user, is_external=True,
+                                               defaults={'name': EXTERNAL_ACCOUNT_NAME, 'balance': 0})
+    return account
+
+
+@retry_on_locked(model=Transaction)
+def _import_chunk(user, account, external, categories, rows):
+    hashes = [row.reference for row in rows]
+    existing = set(Transaction.objects.filter(user=user, import_hash__in=hashes)
+                   .values_list('import_hash', flat=True))
+    records = []
+    for row in rows:
+        if row.reference in existing:
+            continue
+        existing.add(row.reference)
+        incoming = row.amount > 0
+        key = CategoryModel.INCOME if incoming else CategoryModel.EXPENSES
+        records.append(Transaction(
+            user=user,
+            from_account=external if incoming else account,
+            to_account=account if incoming else external,
+            amount=abs(row.amount),
+            date=row.date,
+            comment=row.description[:200] or None,
+            category_id=categories.get((key, row.category)),
+            import_hash=row.reference,
+        ))
+    if not records:
+        return 0
+
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        Transaction.objects.bulk_create(records)
+        # Одно изменение баланса на счет за блок, а не на каждую строку.
+        change = sum(record.amount if record.to_account_id == account.pk else -record.amount
+                     for record in records)
+        Account.objects.filter(pk=account.pk).update(balance=F('balance') + change)
+        Account.objects.filter(pk=external.pk).update(balance=F('balance') - change)
+        transactions_bulk_created.send(sender=Transaction, records=records)
+    return len(records)
+
+
+def import_statement(user, account, rows, chunk_size=1000, errors=None):
+    """
+    Загружает строки выписки по счету account блоками по chunk_size.
+    Строки с ошибками пропускаются, первые MAX_REPORTED_ERRORS из них
+    добавляются в список errors, если он передан.
+    """
+    started = time.monotonic()
+    external = external_account(user)
+    categories = {
+        (key, name): pk for pk, key, name in
+        CategoryModel.objects.filter(user=user).values_list('id', 'key', 'category_name')
+    }
+    created = duplicates = invalid = 0
+
+    cleaned = clean_rows(rows, account.pk)
+    while True:
+        batch = list(islice(cleaned, chunk_size))
+        if not batch:
+            break
+        valid = [row for row, error in batch if row is not None]
+        for _, error in batch:
+            if error is not None:
+                invalid += 1
+                if errors is not None and len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(error)
+        chunk_created = _import_chunk(user, account, external, categories, valid)
+        created += chunk_created
+        duplicates += len(valid) - chunk_created
+
+    return ImportResult(created, duplicates, invalid, time.monotonic() - started)
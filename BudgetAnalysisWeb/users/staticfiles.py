@@ -0,0 +1,215 @@
+import gzip
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.finders import BaseFinder
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Варианты, которые отдаются вместо файла, если клиент их принимает: сначала лучший.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Файлы без хэша в имени (например, images/ava.png по старой ссылке) проверяются при каждом использовании.
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+# Комментарии, строки в кавычках и url(...) находятся одним проходом слева направо:
+# кавычка внутри комментария или /* внутри строки не сбивают разбор.
+_STRING = r'"(?:\\.|[^"\\\n])*"' + '|' + r"'(?:\\.|[^'\\\n])*'"
+_PRESERVED = re.compile(rf'/\*.*?\*/|{_STRING}|url\(\s*(?:{_STRING}|[^)]*)\s*\)', re.S | re.I)
+_PLACEHOLDER = re.compile('\x00(\\d+)\x00')
+_SPACES = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(text):
+    """
+    Убирает комментарии (кроме /*! лицензий */), лишние пробелы и последнюю ; в блоках.
+    Строки в кавычках, url(...) и лицензии остаются как есть.
+    """
+    preserved = []
+
+    def preserve(match):
+        value = match.group(0)
+        if value.startswith('/*') and not value.startswith('/*!'):
+            return ''
+        preserved.append(value)
+        return f'\x00{len(preserved) - 1}\x00'
+
+    text = _PRESERVED.sub(preserve, text)
+    text = _SPACES.sub(' ', text)
+    text = _PUNCTUATION.sub(r'\1', text)
+    # Двоеточие в объявлении (до ближайшей скобки - '}'), а не в селекторе: 'a :hover' != 'a:hover'.
+    text = re.sub(r'\s*:\s*(?![^{}]*\{)', ':', text)
+    text = _PLACEHOLDER.sub(lambda match: preserved[int(match.group(1))], text)
+    return text.replace(';}', '}').strip() + '\n'
+
+
+def bundles():
+    return getattr(settings, 'STATIC_BUNDLES', {})
+
+
+def build_bundle(name, sources):
+    """Склеивает исходные файлы из остальных finders в один; CSS минифицируется."""
+    parts = []
+    for source in sources:
+        path = finders.find(source)
+        if path is None:
+            raise ImproperlyConfigured(f'STATIC_BUNDLES[{name!r}]: файл {source!r} не найден')
+        with open(path, encoding='utf-8') as f:
+            parts.append(f.read())
+    if name.endswith('.css'):
+        return ''.join(minify_css(part) for part in parts)
+    # JS склеивается без изменений: ; на стыке защищает от файла без ; в конце.
+    return ';\n'.join(parts)
+
+
+class BundleFinder(BaseFinder):
+    """
+    Отдает сборки из STATIC_BUNDLES как обычные статические файлы: и runserver,
+    и collectstatic видят их рядом с исходниками. Сборка пересобирается, когда
+    исходники новее нее.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage = FileSystemStorage(location=settings.STATIC_BUILD_ROOT)
+
+    def check(self, **kwargs):
+        return []
+
+    def _build(self, name):
+        sources = bundles()[name]
+        target = self.storage.path(name)
+        source_paths = [finders.find(source) for source in sources]
+        if os.path.exists(target) and all(
+            path and os.path.getmtime(path) <= os.path.getmtime(target) for path in source_paths
+        ):
+            return target
+        content = build_bundle(name, sources)
+        if self.storage.exists(name):
+            self.storage.delete(name)
+        self.storage.save(name, ContentFile(content.encode('utf-8')))
+        return target
+
+    def find(self, path, all=False):
+        if path not in bundles():
+            return []
+        target = self._build(path)
+        return [target] if all else target
+
+    def list(self, ignore_patterns):
+        for name in bundles():
+            self._build(name)
+            yield name, self.storage
+
+
+def compress(content):
+    """{расширение: сжатые байты} для вариантов, которые меньше исходного файла."""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return {suffix: data for suffix, data in variants.items() if len(data) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic пишет файлы с хэшем содержимого в имени (app.3f2a1c.css) и рядом
+    сжатые варианты .gz и .br (brotli - если установлен пакет brotli).
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for hashed_name in set(self.hashed_files.values()):
+            if os.path.splitext(hashed_name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with self.open(hashed_name) as f:
+                content = f.read()
+            for suffix, data in compress(content).items():
+                if self.exists(hashed_name + suffix):
+                    self.delete(hashed_name + suffix)
+                self._save(hashed_name + suffix, ContentFile(data))
+
+    def url(self, name, force=False):
+        if not self.hashed_files and not force:
+            # collectstatic еще не запускался (разработка, тесты): адреса без хэша.
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+
+@lru_cache(maxsize=8)
+def _hashed_names(location, manifest_mtime):
+    return frozenset(CompressedManifestStaticFilesStorage(location=location).hashed_files.values())
+
+
+def _manifest_mtime():
+    path = os.path.join(settings.STATIC_ROOT, ManifestStaticFilesStorage.manifest_name)
+    return path, os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def hashed_names():
+    """Имена с хэшем из манифеста collectstatic; перечитывается, когда манифест меняется."""
+    _, mtime = _manifest_mtime()
+    return _hashed_names(str(settings.STATIC_ROOT), mtime)
+
+
+@lru_cache(maxsize=8)
+def _manifest_version(path, manifest_mtime):
+    if manifest_mtime is None:
+        return ''
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+
+def static_version():
+    """Хэш манифеста collectstatic: меняется с каждой сборкой статики; без манифеста - пустая строка."""
+    return _manifest_version(*_manifest_mtime())
+
+
+def accepted_encodings(accept_encoding):
+    accepted = set()
+    for value in accept_encoding.split(','):
+        name, _, params = value.partition(';')
+        if not re.fullmatch(r'\s*q=0(\.0*)?\s*', params):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def static_validators(full_path):
+    """
+    (ETag, Last-Modified в секундах) файла из STATIC_ROOT. Файл меняется только при
+    collectstatic, поэтому размера и времени изменения достаточно; у сжатых вариантов
+    свой файл и свой ETag.
+    """
+    stat = os.stat(full_path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"', int(stat.st_mtime)
+
+
+def find_static(path, accept_encoding=''):
+    """
+    (полный путь к файлу, Content-Encoding или None, Cache-Control) для path из STATIC_ROOT
+    с учетом Accept-Encoding; None, если файла нет.
+    """
+    full_path = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(full_path):
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    cache_control = IMMUTABLE_CACHE_CONTROL if path in hashed_names() else REVALIDATE_CACHE_CONTROL
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(full_path + suffix):
+            return full_path + suffix, encoding, cache_control
+    return full_path, None, cache_control
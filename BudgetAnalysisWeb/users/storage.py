@@ -0,0 +1,124 @@
+import hashlib
+import os
+import uuid
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from users.thumbnails import make_thumbnail, ICON_EXTENSION
+
+ICON_BLOBS_PREFIX = 'users/static/images/cas'
+ICONS_URL = '/icons/'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит файлы по хэшу содержимого: одинаковые байты записываются один раз,
+    а все строки ссылаются на один и тот же файл.
+    """
+
+    def __init__(self, prefix=ICON_BLOBS_PREFIX, **kwargs):
+        self.prefix = prefix
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def digest(content):
+        hasher = hashlib.blake2b(digest_size=16)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return hasher.hexdigest()
+
+    def blob_name(self, name, digest):
+        ext = os.path.splitext(name)[1].lower()
+        return f'{self.prefix}/{digest[:2]}/{digest}{ext}'
+
+    def prepare(self, name, content):
+        return name, content
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self.store(*self.prepare(name, content), max_length=max_length)
+
+    def store(self, name, content, max_length=None):
+        # Сохраняет уже подготовленное содержимое без повторного prepare().
+        name = self.blob_name(name, self.digest(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Имя - хэш содержимого: файл с таким именем хранит те же байты, другое имя не нужно.
+        return name
+
+    def _save(self, name, content):
+        # Параллельные загрузки одинаковых байтов обе проходят проверку exists() в store().
+        # Каждая пишет свой временный файл и переименовывает его в общее имя: второй
+        # файл заменяет такой же, а недописанный файл под этим именем не виден.
+        directory, filename = os.path.split(name)
+        temporary = super()._save(f'{directory}/.{filename}.{uuid.uuid4().hex}', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+    def ingest(self, path):
+        with open(path, 'rb') as f:
+            return self.save(os.path.basename(path), File(f))
+
+    def blobs(self):
+        if not self.exists(self.prefix):
+            return
+        for shard in self.listdir(self.prefix)[0]:
+            for filename in self.listdir(f'{self.prefix}/{shard}')[1]:
+                if not filename.startswith('.'):
+                    yield f'{self.prefix}/{shard}/{filename}'
+
+
+@deconstructible
+class IconStorage(ContentAddressedStorage):
+    """
+    Перед сохранением приводит изображение к миниатюре ICON_SIZE в формате WebP.
+    Имя файла - хэш содержимого, поэтому по url() файл можно кэшировать навсегда.
+    """
+
+    def prepare(self, name, content):
+        content.seek(0)
+        thumbnail = ContentFile(make_thumbnail(content))
+        return os.path.splitext(name)[0] + ICON_EXTENSION, thumbnail
+
+    def url(self, name):
+        if name.startswith(self.prefix + '/'):
+            return ICONS_URL + name[len(self.prefix) + 1:]
+        return super().url(name)
+
+    def is_normalized(self, name):
+        return name.startswith(self.prefix + '/') and name.endswith(ICON_EXTENSION)
+
+
+icon_storage = IconStorage()
+
+
+@lru_cache(maxsize=None)
+def _default_icon_name(relative_path):
+    with open(os.path.join(settings.MEDIA_ROOT, relative_path), 'rb') as f:
+        name, content = icon_storage.prepare(relative_path, File(f))
+    return icon_storage.blob_name(name, icon_storage.digest(content))
+
+
+def default_icon(relative_path):
+    # Исходный файл хэшируется один раз на процесс, запись происходит
+    # только если такого содержимого еще нет в хранилище.
+    name = _default_icon_name(relative_path)
+    if not icon_storage.exists(name):
+        name = icon_storage.ingest(os.path.join(settings.MEDIA_ROOT, relative_path))
+    return name
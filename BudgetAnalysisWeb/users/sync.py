@@ -0,0 +1,103 @@
+import base64
+from collections import defaultdict
+
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+
+from users.cache import cached_for_user
+from users.models import Account, CategoryModel, ChangeCounter, DeletedRecord, Transaction, next_change_version
+from users.pagination import MAX_ID
+from users.sharding import is_purging
+from users.signals import transactions_bulk_created
+
+# Каждая запись счета, категории или операции получает следующий номер из
+# ChangeCounter пользователя, удаление оставляет DeletedRecord с таким номером.
+# Клиент, знающий номер последней синхронизации, забирает только строки с большим номером.
+SYNC_MODELS = (CategoryModel, Account, Transaction)
+
+
+def sync_state(user):
+    """(номер последнего изменения, reset_version) пользователя."""
+    return cached_for_user(user, 'sync', lambda: tuple(
+        ChangeCounter.objects.filter(user=user).values_list('version', 'reset_version').first() or (0, 0)
+    ))
+
+
+def encode_cursor(version, pk=None):
+    value = str(version) if pk is None else f'{version}|{pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(version, pk) из курсора; pk равен None, если пройдены все строки с этим номером."""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        version, _, pk = value.partition('|')
+        version, pk = int(version), int(pk) if pk else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not 0 <= version <= MAX_ID or pk is not None and not 0 < pk <= MAX_ID:
+        return None
+    return version, pk
+
+
+def changed_after(queryset, version, pk=None):
+    # Строки одной пачки (bulk_create) имеют общий номер, поэтому порядок - (version, id).
+    if pk is None:
+        return queryset.filter(version__gt=version)
+    return queryset.filter(Q(version__gt=version) | Q(version=version, pk__gt=pk))
+
+
+def stamp_version(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        instance.version = next_change_version(instance.user_id, using)
+
+
+def stamp_accounts(records, using):
+    # Балансы меняются UPDATE-ом без save(), поэтому счет получает номер
+    # операции, которая его изменила.
+    versions = {}
+    for record in records:
+        for account_id in (record.from_account_id, record.to_account_id):
+            versions[account_id] = max(versions.get(account_id, 0), record.version)
+    accounts = defaultdict(list)
+    for account_id, version in versions.items():
+        accounts[version].append(account_id)
+    for version, account_ids in accounts.items():
+        Account.objects.using(using).filter(pk__in=account_ids, version__lt=version).update(version=version)
+
+
+def transaction_saved(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        stamp_accounts([instance], using)
+
+
+def transactions_created(sender, records, **kwargs):
+    if records:
+        stamp_accounts(records, records[0]._state.db)
+
+
+def category_deleting(sender, instance, using=None, **kwargs):
+    # Операции категории получат category=NULL через UPDATE, без save().
+    transactions = Transaction.objects.using(using).filter(category=instance)
+    if transactions.exists():
+        transactions.update(version=next_change_version(instance.user_id, using))
+
+
+def record_deleted(sender, instance, using=None, **kwargs):
+    if is_purging(instance.user_id):
+        return
+    DeletedRecord.objects.using(using).create(
+        user_id=instance.user_id,
+        model_name=sender._meta.model_name,
+        object_id=instance.pk,
+        version=next_change_version(instance.user_id, using),
+    )
+
+
+for model in SYNC_MODELS:
+    pre_save.connect(stamp_version, sender=model, dispatch_uid=f'users.sync.{model.__name__}.stamp')
+    post_delete.connect(record_deleted, sender=model, dispatch_uid=f'users.sync.{model.__name__}.delete')
+post_save.connect(transaction_saved, sender=Transaction)
+pre_delete.connect(category_deleting, sender=CategoryModel)
+transactions_bulk_created.connect(transactions_created)
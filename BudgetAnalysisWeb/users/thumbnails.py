@@ -0,0 +1,27 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Иконки показываются в шаблонах размером 50x50, миниатюра хранится
+# в двойном размере для экранов с высокой плотностью пикселей.
+ICON_SIZE = (100, 100)
+ICON_FORMAT = 'WEBP'
+ICON_EXTENSION = '.webp'
+ICON_QUALITY = 80
+
+
+def make_thumbnail(fileobj):
+    with Image.open(fileobj) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе, без распаковки полного кадра.
+        image.draft('RGB', (ICON_SIZE[0] * 2, ICON_SIZE[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA')
+        thumbnail = ImageOps.fit(image, ICON_SIZE, Image.LANCZOS)
+    output = BytesIO()
+    thumbnail.save(output, ICON_FORMAT, quality=ICON_QUALITY, method=6)
+    return output.getvalue()
+
+
+def thumbnail_from_path(path):
+    with open(path, 'rb') as f:
+        return make_thumbnail(f)
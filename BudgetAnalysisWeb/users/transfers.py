@@ -0,0 +1,75 @@
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, connections, router
+from django.db.models import F
+from django.utils import timezone
+
+from users.db import retry_on_locked
+from users.models import Account, Transaction
+from users.signals import transactions_bulk_created
+
+Transfer = namedtuple('Transfer', ['from_account_id', 'to_account_id', 'amount', 'date', 'comment', 'category_id'],
+                      defaults=(None, None, None))
+
+
+class InsufficientFundsError(ValidationError):
+
+    def __init__(self, transfer=None):
+        super().__init__('Недостаточно средств на счете для осуществления перевода', code='insufficient_funds')
+        self.transfer = transfer
+
+
+def lock_accounts(account_ids):
+    # Блокируем строки всегда в порядке возрастания id, чтобы параллельные
+    # переводы A->B и B->A не ждали друг друга по кругу. SQLite блокирует
+    # всю базу при первой записи, поэтому там отдельный SELECT не нужен.
+    connection = connections[router.db_for_write(Account)]
+    if connection.features.has_select_for_update:
+        list(Account.objects.select_for_update().filter(pk__in=account_ids).order_by('pk').values_list('pk'))
+
+
+def _apply(user, transfer):
+    # Проверка остатка выполняется самим UPDATE: если средств не хватает,
+    # ни одна строка не изменится.
+    debited = Account.objects.filter(
+        pk=transfer.from_account_id, user=user, balance__gte=transfer.amount,
+    ).update(balance=F('balance') - transfer.amount)
+    if not debited:
+        raise InsufficientFundsError(transfer)
+    credited = Account.objects.filter(
+        pk=transfer.to_account_id, user=user,
+    ).update(balance=F('balance') + transfer.amount)
+    if not credited:
+        raise ValidationError('Счет зачисления не найден', code='invalid_account')
+    return Transaction(
+        user=user,
+        from_account_id=transfer.from_account_id,
+        to_account_id=transfer.to_account_id,
+        amount=transfer.amount,
+        date=transfer.date or timezone.now().date(),
+        comment=transfer.comment,
+        category_id=transfer.category_id,
+    )
+
+
+@retry_on_locked(model=Account)
+def apply_transfer(user, from_account_id, to_account_id, amount, date=None, comment=None, category_id=None):
+    transfer = Transfer(from_account_id, to_account_id, amount, date, comment, category_id)
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        lock_accounts({from_account_id, to_account_id})
+        record = _apply(user, transfer)
+        record.save()
+    return record
+
+
+@retry_on_locked(model=Account)
+def apply_transfers(user, transfers):
+    """Применяет все переводы в одной транзакции: либо все, либо ни одного."""
+    transfers = list(transfers)
+    account_ids = {t.from_account_id for t in transfers} | {t.to_account_id for t in transfers}
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        lock_accounts(account_ids)
+        records = Transaction.objects.bulk_create([_apply(user, t) for t in transfers])
+        transactions_bulk_created.send(sender=Transaction, records=records)
+    return records
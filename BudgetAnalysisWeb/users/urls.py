@@ -1,6 +1,7 @@
 from django.urls import path, include
 from django.views.generic import TemplateView
 
+from users.api import api_resource
 from users.views import *
 
 urlpatterns = [
@@ -28,10 +29,26 @@ urlpatterns = [
     path('categories/<int:category_id>/edit/', category_edit, name='category_edit'),
     path('categories/<int:category_id>/delete/', category_delete, name='category_delete'),
 
+    path('budgets/', budgets, name='budgets'),
+    path('budgets/<int:budget_id>/delete/', budget_delete, name='budget_delete'),
+
     path('accounts/', accounts, name='accounts'),
     path('accounts/create/', create_account, name='create_account'),
     path('accounts/<int:account_id>/edit/', edit_account, name='edit_account'),
     path('accounts/delete/<int:account_id>/', delete_account, name='delete_account'),
+    path('accounts/autocomplete/', account_autocomplete, name='account_autocomplete'),
 
     path('transfer/', transfer, name='transfer'),
+    path('transfer/import/', statement_upload, name='statement_upload'),
+    path('transactions/', transaction_history, name='transaction_history'),
+    path('transactions/json/', transaction_history_json, name='transaction_history_json'),
+    path('transactions/search/', transaction_search, name='transaction_search'),
+    path('transactions/export/', export_transactions, name='export_transactions'),
+
+    path('analytics/', analytics, name='analytics'),
+    path('metrics/', request_metrics, name='request_metrics'),
+
+    path('api/v1/accounts/', api_resource, {'resource': 'accounts'}, name='api_accounts'),
+    path('api/v1/categories/', api_resource, {'resource': 'categories'}, name='api_categories'),
+    path('api/v1/transactions/', api_resource, {'resource': 'transactions'}, name='api_transactions'),
 ]
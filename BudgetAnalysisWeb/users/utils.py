@@ -1,4 +1,3 @@
-from django.contrib.sites.shortcuts import get_current_site
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
@@ -6,18 +5,15 @@ from django.utils.http import urlsafe_base64_encode
 from django.contrib.auth.tokens import default_token_generator as token_generator
 
 
-def send_email_for_verify(request, user):
-    current_site = get_current_site(request)
-
+def verify_email_message(user, domain):
     context = {
         'user': user,
-        'domain': current_site.domain,
+        'domain': domain,
         'uid': urlsafe_base64_encode(force_bytes(user.pk)),
         'token': token_generator.make_token(user),
     }
 
     message = render_to_string('users/registration/verify_email.html', context=context)
 
-    email = EmailMessage('Verify email', message, to=[user.email])
+    return EmailMessage('Verify email', message, to=[user.email])
 
-    email.send()
@@ -1,6 +1,12 @@
 from django.core.exceptions import ValidationError
 
+from users.schedule import parse_schedule
+
 
 def positive_number_validator(value):
     if value <= 0:
         raise ValidationError('Значение должно быть положительным числом')
+
+
+def schedule_validator(value):
+    parse_schedule(value)
@@ -1,19 +1,46 @@
+import io
+import mimetypes
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, get_user_model
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.views import LoginView
+from django.contrib.auth.views import LoginView, redirect_to_login
 from django.core.exceptions import ValidationError
-from django.utils.http import urlsafe_base64_decode
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlsafe_base64_decode
 from django.views import View
+from django.views.decorators.http import require_safe
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.tokens import default_token_generator as \
     token_generator
+from users import metrics
+from users.analytics import get_analytics
+from users.budgets import user_budgets
+from users.cache import get_categories, get_accounts, hit_rates
+from users.dashboard import gather_dashboard
+from users.export import export_rows, encode_csv, encode_xlsx, gzip_stream
 from users.forms import AuthenticationForm, UserCreationFormImpl, UserProfileForm, CategoryForm, TransactionForm, \
-    AccountForm
-from users.models import UserDataModel, CategoryModel, Account
-from users.utils import send_email_for_verify
+    AccountForm, StatementUploadForm, TransactionFilterForm, CategoryBudgetForm
+from users.models import UserDataModel, CategoryModel, CategoryBudget, Account, Transaction
+from users.outbox import send_email_for_verify
+from users.pagination import keyset_page
+from users.search import search_transactions
+from users.staticfiles import find_static, static_validators
+from users.storage import icon_storage
+from users.statements import import_statement, parse_statement, detect_format
+from users.transfers import apply_transfer, InsufficientFundsError
 
 User = get_user_model()
 
+AUTOCOMPLETE_PAGE_SIZE = 20
+HISTORY_PAGE_SIZE = 50
+ANALYTICS_MONTHS = 12
+SEARCH_QUERY_MAX_LENGTH = 200
+ICON_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 
 class MyLoginView(LoginView):
     form_class = AuthenticationForm
@@ -67,8 +94,18 @@ class Register(View):
         return render(request, self.template_name, context)
 
 
-def main(request):
-    return render(request, 'profile/main.html')
+def _authenticated_user(request):
+    # request.user загружается из базы при первом обращении, поэтому - не в async-коде.
+    return request.user if request.user.is_authenticated else None
+
+
+async def main(request):
+    user = await sync_to_async(_authenticated_user)(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    dashboard = await gather_dashboard(user, timezone.localdate())
+    dashboard['total_balance'] = sum(account.balance for account in dashboard['accounts'])
+    return await sync_to_async(render)(request, 'profile/main.html', dashboard)
 
 
 @login_required
@@ -97,7 +134,7 @@ def edit_profile_view(request):
 
 @login_required
 def category_list(request):
-    categories = CategoryModel.objects.filter(user=request.user)
+    categories = get_categories(request.user)
     context = {
         'categories': categories,
     }
@@ -145,9 +182,32 @@ def category_delete(request, category_id):
     return redirect('category_list')
 
 
+@login_required
+def budgets(request):
+    if request.method == 'POST':
+        form = CategoryBudgetForm(request.POST, user=request.user)
+        if form.is_valid():
+            budget = form.save(commit=False)
+            budget.user = request.user
+            budget.save()
+            return redirect('budgets')
+    else:
+        form = CategoryBudgetForm(user=request.user)
+    return render(request, 'profile/budgets.html', {'budgets': user_budgets(request.user), 'form': form})
+
+
+@login_required
+def budget_delete(request, budget_id):
+    budget = get_object_or_404(CategoryBudget, id=budget_id, user=request.user)
+    budget.delete()
+    return redirect('budgets')
+
+
+@login_required
 def accounts(request):
-    accounts = Account.objects.filter(user=request.user)
-    return render(request, 'profile/accounts/accounts.html', {'accounts': accounts})
+    accounts = get_accounts(request.user)
+    return render(request, 'profile/accounts/accounts.html',
+                  {'accounts': accounts, 'total_balance': sum(account.balance for account in accounts)})
 
 
 def create_account(request):
@@ -184,25 +244,195 @@ def delete_account(request, account_id):
 @login_required
 def transfer(request):
     if request.method == 'POST':
-        form = TransactionForm(request.POST)
+        form = TransactionForm(request.POST, user=request.user)
         if form.is_valid():
-            from_account = form.cleaned_data['from_account']
-            to_account = form.cleaned_data['to_account']
-            amount = form.cleaned_data['amount']
-            date = form.cleaned_data['date']
-            comment = form.cleaned_data['comment']
-            user = request.user # текущий пользователь
-            if from_account.balance >= amount:  # Check if the sender has enough funds
-                from_account.balance -= amount
-                from_account.save()
-                to_account.balance += amount
-                to_account.save()
-                transaction = form.save(commit=False)
-                transaction.user = user
-                transaction.save()
+            try:
+                apply_transfer(
+                    request.user,
+                    form.cleaned_data['from_account'].pk,
+                    form.cleaned_data['to_account'].pk,
+                    form.cleaned_data['amount'],
+                    date=form.cleaned_data['date'],
+                    comment=form.cleaned_data['comment'],
+                    category_id=getattr(form.cleaned_data['category'], 'pk', None),
+                )
                 return redirect('accounts')
-            else:
-                form.add_error('from_account', 'Недостаточно средств на счете для осуществления перевода')
+            except InsufficientFundsError as e:
+                form.add_error('from_account', e)
+            except ValidationError as e:
+                form.add_error('to_account', e)
     else:
-        form = TransactionForm()
+        form = TransactionForm(user=request.user)
     return render(request, 'profile/accounts/transfer.html', {'form': form})
+
+
+@login_required
+def account_autocomplete(request):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    accounts = Account.objects.filter(user=request.user).order_by('name', 'id')
+    query = request.GET.get('q', '').strip()
+    if query:
+        accounts = accounts.filter(name__icontains=query)
+    offset = (page - 1) * AUTOCOMPLETE_PAGE_SIZE
+    rows = list(accounts.values_list('id', 'name')[offset:offset + AUTOCOMPLETE_PAGE_SIZE + 1])
+    return JsonResponse({
+        'results': [{'id': pk, 'text': name} for pk, name in rows[:AUTOCOMPLETE_PAGE_SIZE]],
+        'more': len(rows) > AUTOCOMPLETE_PAGE_SIZE,
+    })
+
+
+@login_required
+def statement_upload(request):
+    result = None
+    errors = []
+    if request.method == 'POST':
+        form = StatementUploadForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = form.cleaned_data['format'] or detect_format(upload.name)
+            stream = io.TextIOWrapper(upload.file, encoding=form.cleaned_data['encoding'], newline='')
+            result = import_statement(request.user, form.cleaned_data['account'],
+                                      parse_statement(stream, fmt), errors=errors)
+    else:
+        form = StatementUploadForm(user=request.user)
+    return render(request, 'profile/accounts/import_statement.html',
+                  {'form': form, 'result': result, 'errors': errors})
+
+
+@login_required
+def export_transactions(request):
+    if request.GET.get('format') == 'xlsx':
+        content = encode_xlsx(export_rows(request.user))
+        content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        filename = 'transactions.xlsx'
+    else:
+        content = encode_csv(export_rows(request.user))
+        content_type = 'text/csv; charset=utf-8'
+        filename = 'transactions.csv'
+        if request.GET.get('gzip'):
+            content = gzip_stream(content)
+            content_type = 'application/gzip'
+            filename += '.gz'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _history_row(record):
+    return {
+        'id': record.pk,
+        'date': record.date.isoformat(),
+        'from_account': record.from_account.name,
+        'to_account': record.to_account.name,
+        'amount': str(record.amount),
+        'category': record.category.category_name if record.category else None,
+        'comment': record.comment,
+    }
+
+
+def _history_page(request):
+    form = TransactionFilterForm(request.GET, user=request.user)
+    queryset = Transaction.objects.filter(user=request.user) \
+        .select_related('from_account', 'to_account', 'category') \
+        .only('id', 'date', 'amount', 'comment', 'from_account__name', 'to_account__name',
+              'category__category_name')
+    if form.is_valid():
+        queryset = form.filter(queryset)
+    else:
+        queryset = queryset.none()
+    rows, next_cursor = keyset_page(queryset, request.GET.get('cursor'), HISTORY_PAGE_SIZE)
+    return form, rows, next_cursor
+
+
+@login_required
+def transaction_history(request):
+    form, rows, next_cursor = _history_page(request)
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_query = params.urlencode()
+    return render(request, 'profile/accounts/history.html',
+                  {'form': form, 'transactions': rows, 'next_query': next_query})
+
+
+@login_required
+def transaction_history_json(request):
+    form, rows, next_cursor = _history_page(request)
+    if form.errors:
+        return JsonResponse({'errors': form.errors}, status=400)
+    return JsonResponse({
+        'results': [_history_row(record) for record in rows],
+        'next': next_cursor,
+    })
+
+
+@login_required
+@require_safe
+def transaction_search(request):
+    """Операции пользователя по словам из ?q= в комментарии или категории, лучшие совпадения первыми."""
+    query = request.GET.get('q', '')
+    if len(query) > SEARCH_QUERY_MAX_LENGTH:
+        return JsonResponse({'errors': {'q': [f'Не более {SEARCH_QUERY_MAX_LENGTH} символов']}}, status=400)
+    return JsonResponse({'results': [_history_row(record) for record in search_transactions(request.user, query)]})
+
+
+@require_safe
+def serve_icon(request, shard, filename):
+    # Имя иконки - хэш ее содержимого, поэтому файл по этому адресу никогда не меняется.
+    name = f'{icon_storage.prefix}/{shard}/{filename}'
+    if not filename.startswith(shard) or not icon_storage.exists(name):
+        raise Http404
+    response = FileResponse(icon_storage.open(name), content_type='image/webp')
+    response['Cache-Control'] = ICON_CACHE_CONTROL
+    return response
+
+
+@require_safe
+def serve_static(request, path):
+    # Файлы из STATIC_ROOT после collectstatic: сжатый вариант, если клиент его принимает;
+    # у файлов с хэшем в имени - immutable, повторная загрузка страницы их не перепроверяет.
+    found = find_static(path, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if found is None:
+        raise Http404
+    full_path, encoding, cache_control = found
+    # Файлы без хэша (must-revalidate) перепроверяются условным запросом: 304 без тела.
+    etag, last_modified = static_validators(full_path)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = cache_control
+    return response
+
+
+@login_required
+def analytics(request):
+    data = get_analytics(request.user)
+    recent = slice(-ANALYTICS_MONTHS, None)
+    columns = ('income', 'expenses', 'rolling_income', 'rolling_expenses', 'savings_rate')
+    months = [
+        dict(month=month, **dict(zip(columns, values)))
+        for month, *values in zip(data['months'][recent], *(data[column][recent] for column in columns))
+    ]
+    categories = sorted(
+        ({**category, 'total': round(sum(value for value in category['monthly'][recent]), 2)}
+         for category in data['categories']),
+        key=lambda category: -category['total'],
+    )
+    return render(request, 'profile/analytics.html', {
+        'months': months[::-1], 'categories': categories, 'forecast': data['forecast'],
+    })
+
+
+@staff_member_required
+def request_metrics(request):
+    return JsonResponse({'window': metrics.ROLLING_WINDOW, 'urls': metrics.snapshot(), 'cache': hit_rates()})